@@ -0,0 +1,27 @@
+# Time `import swmfio` in fresh interpreters and list the heavy dependencies
+# that the import pulls in. Run: python bench_import.py [repeats]
+
+import sys
+import subprocess
+
+repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+code = '''
+import sys
+from timeit import default_timer as timer
+start = timer()
+import swmfio
+end = timer()
+heavy = [m for m in ('numpy', 'numba', 'scipy', 'cffi') if m in sys.modules]
+print(end - start, ','.join(heavy))
+'''
+
+times = []
+for i in range(repeats):
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    dt, heavy = (out.stdout.split() + [''])[:2]
+    times.append(float(dt))
+
+times.sort()
+print(f"import swmfio: min {1000*times[0]:.1f} ms, median {1000*times[len(times)//2]:.1f} ms ({repeats} runs)")
+print("Heavy modules imported: " + (heavy if heavy else "none"))
@@ -1,9 +1,69 @@
-from swmfio.read_rim import read_rim
-from swmfio.read_batsrus import read_batsrus
-from swmfio.write_vtk import write_vtk
-from swmfio.util import fileparts
-from swmfio.util import dlfile
-from swmfio.batsrus_interpolator import batsrus_interpolator
+import sys
+import types
+import importlib
+
+# Public functions and the submodules that define them. They are imported on
+# first attribute access (PEP 562) so that `import swmfio` does not pull in
+# numba, scipy or the compiled OCTREE cffi module until they are needed.
+_lazy_functions = {
+    'read_rim'             : 'swmfio.read_rim',
+    'read_batsrus'         : 'swmfio.read_batsrus',
+    'write_vtk'            : 'swmfio.write_vtk',
+    'fileparts'            : 'swmfio.util',
+    'dlfile'               : 'swmfio.util',
+    'ReadStats'            : 'swmfio.util',
+    'batsrus_interpolator' : 'swmfio.batsrus_interpolator',
+    'BlockLocator'         : 'swmfio.batsrus_class',
+    'InterpolationPlan'    : 'swmfio.batsrus_class',
+    'SpaceTimeInterpolator': 'swmfio.batsrus_spacetime',
+    'export_shared'        : 'swmfio.batsrus_shared',
+    'attach_shared'        : 'swmfio.batsrus_shared',
+}
+
+_lazy_submodules = (
+    'batsrus_class',
+    'batsrus_interpolator',
+    'batsrus_nogil',
+    'batsrus_shared',
+    'batsrus_spacetime',
+    'constants',
+    'read_batsrus',
+    'read_rim',
+    'util',
+    'vtk_export',
+    'write_vtk',
+)
+
+def __getattr__(name):
+    if name == 'logger':
+        # Created on first use; importing logging costs more than the rest of
+        # the package import.
+        globals()['logger'] = _logger()
+        return globals()['logger']
+    if name in _lazy_functions:
+        module = importlib.import_module(_lazy_functions[name])
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    if name in _lazy_submodules:
+        return importlib.import_module('swmfio.' + name)
+    raise AttributeError(f"module 'swmfio' has no attribute '{name}'")
+
+def __dir__():
+    return sorted(set(globals()) | {'logger'} | set(_lazy_functions) | set(_lazy_submodules))
+
+class _Package(types.ModuleType):
+
+    def __setattr__(self, name, value):
+        # After loading a submodule, the import system binds it onto this
+        # package. For read_rim, read_batsrus, write_vtk and
+        # batsrus_interpolator that would shadow the function of the same
+        # name, so bind the function instead (as the eager imports did).
+        if name in _lazy_functions and isinstance(value, types.ModuleType):
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = _Package
 
 def _logger():
     import sys
@@ -21,6 +81,3 @@ def _logger():
     logger.setLevel(logging.WARN)
 
     return logger
-
-logger = _logger()
-
@@ -1,3 +1,5 @@
+import os
+import contextlib
 import numpy as np 
 import numba
 
@@ -6,7 +8,7 @@ import numba
 numba.config.DISABLE_JIT = False
 
 import swmfio
-from swmfio.constants import Used_,Unused_,Status_,Level_,Parent_,Child1_,Coord1_,CoordLast_
+from swmfio.constants import PointOk_,PointOutside_,PointInBody_,Unset_,Used_,Unused_,Status_,Level_,Parent_,Child1_,Coord1_,CoordLast_
 from swmfio.read_batsrus import read_tree, read_data
 from swmfio.util import unravel_index
 
@@ -18,6 +20,644 @@ def F2P(fortran_index):
 def P2F(python_index):
     return python_index + 1
 
+
+@numba.njit
+def _node_contains(batsclass, iNode, point):
+    xin = batsclass.block_x_min[F2P(iNode)] <= point[0] <= batsclass.block_x_max[F2P(iNode)]
+    yin = batsclass.block_y_min[F2P(iNode)] <= point[1] <= batsclass.block_y_max[F2P(iNode)]
+    zin = batsclass.block_z_min[F2P(iNode)] <= point[2] <= batsclass.block_z_max[F2P(iNode)]
+    return xin and yin and zin
+
+@numba.njit
+def _descend_tree(batsclass, iNode, point):
+    '''Leaf node below iNode that contains point, which must be in iNode.'''
+
+    while True:
+        if batsclass.block_child_count[F2P(iNode)] == 0:
+            break
+
+        for j in range(batsclass.block_child_count[F2P(iNode)]):
+            child = batsclass.block_child_ids[j, F2P(iNode)]
+            if _node_contains(batsclass, child, point):
+                iNode = child
+                break
+
+        # TODO: Add check for max depth to prevent loop from never ending.
+    return iNode
+
+
+@numba.njit
+def _lookup_grid_node(batsclass, point):
+    '''Node stored in the lookup grid cell that contains point.'''
+    nx, ny, nz = batsclass.lookup_grid.shape
+    ix = min(int((point[0] - batsclass.xGlobalMin)/batsclass.lookup_dx), nx - 1)
+    iy = min(int((point[1] - batsclass.yGlobalMin)/batsclass.lookup_dy), ny - 1)
+    iz = min(int((point[2] - batsclass.zGlobalMin)/batsclass.lookup_dz), nz - 1)
+    return batsclass.lookup_grid[ix, iy, iz]
+
+
+@numba.njit
+def _spread_bits(v):
+    '''Insert two zero bits between each of the low 21 bits of v.'''
+    x = np.uint64(v) & np.uint64(0x1fffff)
+    x = (x | (x << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+    x = (x | (x << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+    x = (x | (x << np.uint64(8)))  & np.uint64(0x100f00f00f00f00f)
+    x = (x | (x << np.uint64(4)))  & np.uint64(0x10c30c30c30c30c3)
+    x = (x | (x << np.uint64(2)))  & np.uint64(0x1249249249249249)
+    return x
+
+@numba.njit
+def _morton_encode(ix, iy, iz):
+    return _spread_bits(ix) | (_spread_bits(iy) << np.uint64(1)) | (_spread_bits(iz) << np.uint64(2))
+
+
+@numba.njit
+def _morton_find_node(batsclass, point):
+    '''Leaf node that contains point, from the Morton index.'''
+    ix = min(int((point[0] - batsclass.xGlobalMin)/batsclass.morton_dx), batsclass.morton_n[0] - 1)
+    iy = min(int((point[1] - batsclass.yGlobalMin)/batsclass.morton_dy), batsclass.morton_n[1] - 1)
+    iz = min(int((point[2] - batsclass.zGlobalMin)/batsclass.morton_dz), batsclass.morton_n[2] - 1)
+    # Each leaf covers the range of keys from its own key up to the next
+    # leaf's key, so the leaf is the last one with a key <= the point's key.
+    n = np.searchsorted(batsclass.morton_keys, _morton_encode(ix, iy, iz), side='right') - 1
+    return batsclass.morton_nodes[n]
+
+
+@numba.njit
+def _trilinear_stencil(DA, _x, _y, _z, iBlockP, point):
+    '''Indices of the cells that bracket point in block iBlockP and the
+    fractional position of point between them.'''
+
+    nVar, nI, nJ, nK, nBlock = DA.shape
+
+    # get the gridspacing in x,y,z
+    gridspacingX = DA[_x,1,0,0,iBlockP] - DA[_x,0,0,0,iBlockP]
+    gridspacingY = DA[_y,0,1,0,iBlockP] - DA[_y,0,0,0,iBlockP]
+    gridspacingZ = DA[_z,0,0,1,iBlockP] - DA[_z,0,0,0,iBlockP]
+
+    # i0 is s.t. the highest index s.t. the x coordinate of the 
+    #  corresponding cell block_data[iNode,i0,:,:]  is still less than point[0]
+    i0 = (point[0] - DA[_x, 0, 0, 0, iBlockP])/gridspacingX
+    j0 = (point[1] - DA[_y, 0, 0, 0, iBlockP])/gridspacingY
+    k0 = (point[2] - DA[_z, 0, 0, 0, iBlockP])/gridspacingZ
+    #if i0.is_integer() and j0.is_integer() and k0.is_integer(): # doesnt work in numba
+    #    is_native = True
+    #    print( (iBlockP,int(i0),int(j0),int(k0)) )# (iBlockP,i,j,k)
+    #    i0 = int(i0)
+    #    j0 = int(j0)
+    #    k0 = int(k0)
+    i0 = int(np.floor(i0))
+    j0 = int(np.floor(j0))
+    k0 = int(np.floor(k0))
+
+    # i1 = i0+1 is the lowest index s.t. the x coordinate of the 
+    #  corresponding cell block_data[iNode,i1,:,:]  is still greater than point[0]
+    # together, i0 and i1 form the upper and lower bounds for a linear interpolation in x
+    # likewise for j0,j1,y  and k0,k1,z
+
+    # Without a halo, the stencil is clamped at the ends of the block, which
+    # makes it nearest neighbor there. build_halo() gives the cells of the
+    # neighboring blocks instead (see _halo_stencil()).
+    if i0 == -1:
+        i0 = 0
+        i1 = 0
+    elif i0 == nI-1:
+        i1 = nI-1
+    else:
+        i1 = i0 + 1
+
+    if j0 == -1:
+        j0 = 0
+        j1 = 0
+    elif j0 == nJ-1:
+        j1 = nJ-1
+    else:
+        j1 = j0 + 1
+
+    if k0 == -1:
+        k0 = 0
+        k1 = 0
+    elif k0 == nK-1:
+        k1 = nK-1
+    else:
+        k1 = k0 + 1
+
+    # all together i0,i1,j0, etc... form a cube of side length "gridpacing"
+    # To do trilinear interpolation within, define xd as the distance
+    # along x of point within that cube, in units of "gridspacing"
+    xd = (point[0] - DA[_x, i0, 0 , 0 , iBlockP])/gridspacingX
+    yd = (point[1] - DA[_y, 0 , j0, 0 , iBlockP])/gridspacingY
+    zd = (point[2] - DA[_z, 0 , 0 , k0, iBlockP])/gridspacingZ
+
+    return i0, i1, j0, j1, k0, k1, xd, yd, zd
+
+@numba.njit
+def _halo_stencil(DA, _x, _y, _z, iBlockP, point):
+    '''Like _trilinear_stencil(), but for indexing the halo array, which has
+    one ghost cell on each side, so no clamping is needed at block edges.'''
+
+    nVar, nI, nJ, nK, nBlock = DA.shape
+
+    gridspacingX = DA[_x,1,0,0,iBlockP] - DA[_x,0,0,0,iBlockP]
+    gridspacingY = DA[_y,0,1,0,iBlockP] - DA[_y,0,0,0,iBlockP]
+    gridspacingZ = DA[_z,0,0,1,iBlockP] - DA[_z,0,0,0,iBlockP]
+
+    x = (point[0] - DA[_x, 0, 0, 0, iBlockP])/gridspacingX
+    y = (point[1] - DA[_y, 0, 0, 0, iBlockP])/gridspacingY
+    z = (point[2] - DA[_z, 0, 0, 0, iBlockP])/gridspacingZ
+
+    # Between -1 and nI-1 for a point in the block, up to rounding
+    i0 = min(max(int(np.floor(x)), -1), nI-1)
+    j0 = min(max(int(np.floor(y)), -1), nJ-1)
+    k0 = min(max(int(np.floor(z)), -1), nK-1)
+
+    # +1 for the ghost cell
+    return i0+1, i0+2, j0+1, j0+2, k0+1, k0+2, x-i0, y-j0, z-k0
+
+@numba.njit
+def _stencil(batsclass, _x, _y, _z, iBlockP, point):
+    '''Trilinear stencil for point in block iBlockP of _values(batsclass).'''
+    if batsclass.halo.size > 0:
+        return _halo_stencil(batsclass.DataArray, _x, _y, _z, iBlockP, point)
+    return _trilinear_stencil(batsclass.DataArray, _x, _y, _z, iBlockP, point)
+
+@numba.njit
+def _values(batsclass):
+    '''Array to interpolate from: the halo array if it was built.'''
+    if batsclass.halo.size > 0:
+        return batsclass.halo
+    return batsclass.DataArray
+
+@numba.njit
+def _values_arr(batsclass):
+    '''Two-dimensional (cell, variable) array that _values() is a view of.'''
+    if batsclass.halo.size > 0:
+        return batsclass.halo_arr
+    return batsclass.data_arr
+
+@numba.njit
+def _var_indices(varidx, variables):
+    '''Index in DataArray (and column of data_arr) of each of variables, a
+    tuple of names.'''
+    iVars = np.empty(len(variables), dtype=np.int32)
+    for v in range(len(variables)):
+        iVars[v] = varidx[variables[v]]
+    return iVars
+
+
+@numba.njit
+def _trilinear(DA, iVar, iBlockP, i0, i1, j0, j1, k0, k1, xd, yd, zd):
+
+    #https://en.wikipedia.org/wiki/Trilinear_interpolation
+    c000 = DA[iVar,  i0, j0, k0,  iBlockP]
+    c001 = DA[iVar,  i0, j0, k1,  iBlockP]
+    c010 = DA[iVar,  i0, j1, k0,  iBlockP]
+    c100 = DA[iVar,  i1, j0, k0,  iBlockP]
+    c011 = DA[iVar,  i0, j1, k1,  iBlockP]
+    c110 = DA[iVar,  i1, j1, k0,  iBlockP]
+    c101 = DA[iVar,  i1, j0, k1,  iBlockP]
+    c111 = DA[iVar,  i1, j1, k1,  iBlockP]
+
+    c00 = c000*(1.-xd) + c100*xd
+    c01 = c001*(1.-xd) + c101*xd
+    c10 = c010*(1.-xd) + c110*xd
+    c11 = c011*(1.-xd) + c111*xd
+
+    c0 = c00*(1.-yd) + c10*yd
+    c1 = c01*(1.-yd) + c11*yd
+
+    c = c0*(1.-zd) + c1*zd
+    return c
+
+@numba.njit
+def _one_sided(i0, i1, n):
+    '''Pair of cells for a derivative across a stencil that may be clamped
+    at a block edge (i0 == i1): then the edge cell and its neighbor in the
+    block.'''
+    if i0 != i1:
+        return i0, i1
+    ia = min(i0, n-2)
+    return ia, ia+1
+
+@numba.njit
+def _trilinear_gradient(DA, iVar, iBlockP, i0, i1, j0, j1, k0, k1, xd, yd, zd, dx, dy, dz):
+    '''Trilinear value and its x, y and z derivatives from the same eight
+    cells. dx, dy and dz are the grid spacings of block iBlockP.'''
+
+    nVar, nI, nJ, nK, nBlock = DA.shape
+
+    c = _trilinear(DA, iVar, iBlockP, i0, i1, j0, j1, k0, k1, xd, yd, zd)
+
+    # Where the stencil is clamped at a block edge (no halo), the derivative
+    # across it is a one-sided difference of the edge cell and its neighbor
+    # instead of zero.
+    ia, ib = _one_sided(i0, i1, nI)
+    ja, jb = _one_sided(j0, j1, nJ)
+    ka, kb = _one_sided(k0, k1, nK)
+
+    dcdx = ((DA[iVar, ib, j0, k0, iBlockP] - DA[iVar, ia, j0, k0, iBlockP])*(1.-yd)*(1.-zd)
+          + (DA[iVar, ib, j1, k0, iBlockP] - DA[iVar, ia, j1, k0, iBlockP])*yd*(1.-zd)
+          + (DA[iVar, ib, j0, k1, iBlockP] - DA[iVar, ia, j0, k1, iBlockP])*(1.-yd)*zd
+          + (DA[iVar, ib, j1, k1, iBlockP] - DA[iVar, ia, j1, k1, iBlockP])*yd*zd)/dx
+    dcdy = ((DA[iVar, i0, jb, k0, iBlockP] - DA[iVar, i0, ja, k0, iBlockP])*(1.-xd)*(1.-zd)
+          + (DA[iVar, i1, jb, k0, iBlockP] - DA[iVar, i1, ja, k0, iBlockP])*xd*(1.-zd)
+          + (DA[iVar, i0, jb, k1, iBlockP] - DA[iVar, i0, ja, k1, iBlockP])*(1.-xd)*zd
+          + (DA[iVar, i1, jb, k1, iBlockP] - DA[iVar, i1, ja, k1, iBlockP])*xd*zd)/dy
+    dcdz = ((DA[iVar, i0, j0, kb, iBlockP] - DA[iVar, i0, j0, ka, iBlockP])*(1.-xd)*(1.-yd)
+          + (DA[iVar, i1, j0, kb, iBlockP] - DA[iVar, i1, j0, ka, iBlockP])*xd*(1.-yd)
+          + (DA[iVar, i0, j1, kb, iBlockP] - DA[iVar, i0, j1, ka, iBlockP])*(1.-xd)*yd
+          + (DA[iVar, i1, j1, kb, iBlockP] - DA[iVar, i1, j1, ka, iBlockP])*xd*yd)/dz
+
+    return c, dcdx, dcdy, dcdz
+
+@numba.njit
+def _grid_spacing(DA, _x, _y, _z, iBlockP):
+    return (DA[_x,1,0,0,iBlockP] - DA[_x,0,0,0,iBlockP],
+            DA[_y,0,1,0,iBlockP] - DA[_y,0,0,0,iBlockP],
+            DA[_z,0,0,1,iBlockP] - DA[_z,0,0,0,iBlockP])
+
+@numba.njit
+def _point_status(batsclass, point, rbody):
+    '''PointOk_, or why point is not interpolated in the batch paths.'''
+    xin = batsclass.xGlobalMin <= point[0] <= batsclass.xGlobalMax
+    yin = batsclass.yGlobalMin <= point[1] <= batsclass.yGlobalMax
+    zin = batsclass.zGlobalMin <= point[2] <= batsclass.zGlobalMax
+    if not (xin and yin and zin):
+        return PointOutside_
+    if point[0]**2 + point[1]**2 + point[2]**2 < rbody**2:
+        return PointInBody_
+    return PointOk_
+
+@numba.njit
+def _query_order(batsclass, points, sort):
+    '''Order in which the batch kernels process points: if sort, by the
+    Morton key of their position in the domain, so that consecutive points
+    (and the points of each thread) are close in space and use the same
+    blocks; otherwise an empty array, meaning the given order. Results are
+    written to the rows of the original points either way.'''
+
+    if not sort:
+        return np.empty(0, dtype=np.int64)
+
+    keys = np.empty(points.shape[0], dtype=np.uint64)
+    _point_morton_keys(batsclass, points, keys)
+
+    return np.argsort(keys)
+
+@numba.njit(parallel=True)
+def _point_morton_keys(batsclass, points, keys):
+    nMax = 2**21 - 1
+    for n in numba.prange(points.shape[0]):
+        if _point_status(batsclass, points[n], 0.) != PointOk_:
+            keys[n] = 0
+            continue
+        ix = int(nMax*(points[n, 0] - batsclass.xGlobalMin)/(batsclass.xGlobalMax - batsclass.xGlobalMin))
+        iy = int(nMax*(points[n, 1] - batsclass.yGlobalMin)/(batsclass.yGlobalMax - batsclass.yGlobalMin))
+        iz = int(nMax*(points[n, 2] - batsclass.zGlobalMin)/(batsclass.zGlobalMax - batsclass.zGlobalMin))
+        keys[n] = _morton_encode(ix, iy, iz)
+
+@numba.njit
+def _interpolate_many_ivars(batsclass, points, iVars, fill, rbody, sort):
+
+    out = np.empty((points.shape[0], iVars.size), dtype=np.float64)
+    status = np.empty(points.shape[0], dtype=np.int8)
+    _interpolate_many(batsclass, points, _query_order(batsclass, points, sort), iVars, out, status, fill, rbody)
+
+    return out, status
+
+@numba.njit(parallel=True)
+def _interpolate_many(batsclass, points, order, iVars, out, status, fill, rbody):
+    '''Interpolate variables iVars at points into out[:, len(iVars)]. The
+    cell search and weights are computed once per point. Points with a
+    status other than PointOk_ get the value fill; no exception is raised
+    (which in a prange loop would not propagate cleanly).'''
+
+    _x = batsclass.varidx['x']
+    _y = batsclass.varidx['y']
+    _z = batsclass.varidx['z']
+
+    DA = _values(batsclass)
+
+    for m in numba.prange(points.shape[0]):
+        n = np.int64(m) if order.size == 0 else np.int64(order[m])
+        status[n] = _interpolate_point(batsclass, DA, _x, _y, _z, points[n], iVars, fill, rbody, out[n])
+
+@numba.njit
+def _interpolate_point(batsclass, DA, _x, _y, _z, point, iVars, fill, rbody, out):
+    '''Interpolate variables iVars at point into out, a row of the result
+    of a batch kernel. Returns the status of point; out is fill unless it is
+    PointOk_.'''
+
+    status = _point_status(batsclass, point, rbody)
+    if status != PointOk_:
+        out[:] = fill
+        return status
+    iNode = batsclass.find_tree_node(point)
+    iBlockP = batsclass.node2block[F2P(iNode)]
+    i0, i1, j0, j1, k0, k1, xd, yd, zd = _stencil(batsclass, _x, _y, _z, iBlockP, point)
+    for v in range(iVars.size):
+        out[v] = _trilinear(DA, iVars[v], iBlockP, i0, i1, j0, j1, k0, k1, xd, yd, zd)
+    return status
+
+@numba.njit
+def _check_in_domain(batsclass, points):
+    # find_tree_node() raises for these too, but an exception raised inside
+    # a prange loop does not propagate cleanly.
+    for n in range(points.shape[0]):
+        if _point_status(batsclass, points[n], 0.) == PointOutside_:
+            raise RuntimeError('point out of simulation volume')
+
+@numba.njit(parallel=True)
+def _find_tree_nodes(batsclass, points, nodes):
+    for n in numba.prange(points.shape[0]):
+        nodes[n] = batsclass.find_tree_node(points[n])
+
+@numba.njit
+def _interpolate_many_gradient_ivars(batsclass, points, iVars, fill, rbody, sort):
+
+    values = np.empty((points.shape[0], iVars.size), dtype=np.float64)
+    gradients = np.empty((points.shape[0], iVars.size, 3), dtype=np.float64)
+    status = np.empty(points.shape[0], dtype=np.int8)
+    order = _query_order(batsclass, points, sort)
+    _interpolate_many_gradient(batsclass, points, order, iVars, values, gradients, status, fill, rbody)
+
+    return values, gradients, status
+
+@numba.njit(parallel=True)
+def _interpolate_many_gradient(batsclass, points, order, iVars, values, gradients, status, fill, rbody):
+
+    _x = batsclass.varidx['x']
+    _y = batsclass.varidx['y']
+    _z = batsclass.varidx['z']
+
+    DA = _values(batsclass)
+
+    for m in numba.prange(points.shape[0]):
+        n = np.int64(m) if order.size == 0 else np.int64(order[m])
+        point = points[n]
+        status[n] = _point_status(batsclass, point, rbody)
+        if status[n] != PointOk_:
+            values[n, :] = fill
+            gradients[n, :, :] = fill
+            continue
+        iNode = batsclass.find_tree_node(point)
+        iBlockP = batsclass.node2block[F2P(iNode)]
+        i0, i1, j0, j1, k0, k1, xd, yd, zd = _stencil(batsclass, _x, _y, _z, iBlockP, point)
+        dx, dy, dz = _grid_spacing(batsclass.DataArray, _x, _y, _z, iBlockP)
+        for v in range(iVars.size):
+            c, dcdx, dcdy, dcdz = _trilinear_gradient(DA, iVars[v], iBlockP, i0, i1, j0, j1, k0, k1, xd, yd, zd, dx, dy, dz)
+            values[n, v] = c
+            gradients[n, v, 0] = dcdx
+            gradients[n, v, 1] = dcdy
+            gradients[n, v, 2] = dcdz
+
+@numba.njit(parallel=True)
+def _fill_plan(batsclass, points, order, cells, weights, status, rbody):
+    '''Rows of _values_arr(batsclass) and the trilinear weights of the eight
+    cells used to interpolate at each point.'''
+
+    _x = batsclass.varidx['x']
+    _y = batsclass.varidx['y']
+    _z = batsclass.varidx['z']
+
+    nVar, mI, mJ, mK, nBlock = _values(batsclass).shape
+
+    for m in numba.prange(points.shape[0]):
+        n = np.int64(m) if order.size == 0 else np.int64(order[m])
+        point = points[n]
+        status[n] = _point_status(batsclass, point, rbody)
+        if status[n] != PointOk_:
+            cells[n, :] = 0
+            weights[n, :] = 0.
+            continue
+        iNode = batsclass.find_tree_node(point)
+        iBlockP = batsclass.node2block[F2P(iNode)]
+        i0, i1, j0, j1, k0, k1, xd, yd, zd = _stencil(batsclass, _x, _y, _z, iBlockP, point)
+        # Same order as the corners in _trilinear()
+        for c in range(8):
+            i = i1 if c & 1 else i0
+            j = j1 if c & 2 else j0
+            k = k1 if c & 4 else k0
+            cells[n, c] = i + mI*(j + mJ*(k + mK*iBlockP))
+            weights[n, c] = (xd if c & 1 else 1. - xd)*(yd if c & 2 else 1. - yd)*(zd if c & 4 else 1. - zd)
+
+@numba.njit(parallel=True)
+def _apply_plan(cells, weights, status, values, iVars, fill, out):
+    for n in numba.prange(cells.shape[0]):
+        if status[n] != PointOk_:
+            out[n, :] = fill
+            continue
+        for v in range(iVars.size):
+            c = 0.
+            for m in range(8):
+                c += weights[n, m]*values[cells[n, m], iVars[v]]
+            out[n, v] = c
+
+@numba.njit(parallel=True)
+def _cell_index(batsclass, points, cells, indx):
+
+    _x = batsclass.varidx['x']
+    _y = batsclass.varidx['y']
+    _z = batsclass.varidx['z']
+
+    DA = batsclass.DataArray
+    nVar, nI, nJ, nK, nBlock = DA.shape
+
+    for n in numba.prange(points.shape[0]):
+        point = points[n]
+        if _point_status(batsclass, point, 0.) != PointOk_:
+            cells[n, :] = -1
+            indx[n] = -1
+            continue
+        iBlockP = batsclass.node2block[F2P(batsclass.find_tree_node(point))]
+        dx, dy, dz = _grid_spacing(DA, _x, _y, _z, iBlockP)
+        # Nearest cell center; rounding makes this exact for points on
+        # cell centers.
+        i = min(max(int(np.floor((point[0] - DA[_x,0,0,0,iBlockP])/dx + 0.5)), 0), nI-1)
+        j = min(max(int(np.floor((point[1] - DA[_y,0,0,0,iBlockP])/dy + 0.5)), 0), nJ-1)
+        k = min(max(int(np.floor((point[2] - DA[_z,0,0,0,iBlockP])/dz + 0.5)), 0), nK-1)
+        cells[n, 0] = iBlockP
+        cells[n, 1] = i
+        cells[n, 2] = j
+        cells[n, 3] = k
+        indx[n] = i + nI*j + nI*nJ*k + nI*nJ*nK*iBlockP
+
+@numba.njit(parallel=True)
+def _gather(data_arr, indx, iVars, out):
+    for n in numba.prange(indx.size):
+        for v in range(iVars.size):
+            out[n, v] = data_arr[indx[n], iVars[v]] if indx[n] >= 0 else np.nan
+
+@numba.njit
+def _cell_partials(DA, iVar, i, j, k, iBlockP, dx, dy, dz):
+    '''Partial derivatives of variable iVar at cell (i, j, k) of block
+    iBlockP: centered differences inside the block, one-sided at its
+    faces.'''
+
+    nVar, nI, nJ, nK, nBlock = DA.shape
+
+    if i == 0:
+        ddx = (DA[iVar, 1, j, k, iBlockP] - DA[iVar, 0, j, k, iBlockP])/dx
+    elif i == nI-1:
+        ddx = (DA[iVar, nI-1, j, k, iBlockP] - DA[iVar, nI-2, j, k, iBlockP])/dx
+    else:
+        ddx = (DA[iVar, i+1, j, k, iBlockP] - DA[iVar, i-1, j, k, iBlockP])/(2*dx)
+
+    if j == 0:
+        ddy = (DA[iVar, i, 1, k, iBlockP] - DA[iVar, i, 0, k, iBlockP])/dy
+    elif j == nJ-1:
+        ddy = (DA[iVar, i, nJ-1, k, iBlockP] - DA[iVar, i, nJ-2, k, iBlockP])/dy
+    else:
+        ddy = (DA[iVar, i, j+1, k, iBlockP] - DA[iVar, i, j-1, k, iBlockP])/(2*dy)
+
+    if k == 0:
+        ddz = (DA[iVar, i, j, 1, iBlockP] - DA[iVar, i, j, 0, iBlockP])/dz
+    elif k == nK-1:
+        ddz = (DA[iVar, i, j, nK-1, iBlockP] - DA[iVar, i, j, nK-2, iBlockP])/dz
+    else:
+        ddz = (DA[iVar, i, j, k+1, iBlockP] - DA[iVar, i, j, k-1, iBlockP])/(2*dz)
+
+    return ddx, ddy, ddz
+
+@numba.njit
+def _domain_faces(batsclass, DA, _x, _y, _z, iBlockP, dx, dy, dz):
+    '''Which faces of block iBlockP (x low, x high, y low, ...) are on the
+    boundary of the domain: the halo has no neighbor values across them
+    (see build_halo()).'''
+
+    nVar, nI, nJ, nK, nBlock = DA.shape
+
+    return (DA[_x,0,0,0,iBlockP] - dx < batsclass.xGlobalMin,
+            DA[_x,0,0,0,iBlockP] + nI*dx > batsclass.xGlobalMax,
+            DA[_y,0,0,0,iBlockP] - dy < batsclass.yGlobalMin,
+            DA[_y,0,0,0,iBlockP] + nJ*dy > batsclass.yGlobalMax,
+            DA[_z,0,0,0,iBlockP] - dz < batsclass.zGlobalMin,
+            DA[_z,0,0,0,iBlockP] + nK*dz > batsclass.zGlobalMax)
+
+@numba.njit
+def _halo_partials(H, iVar, i, j, k, iBlockP, dx, dy, dz, faces):
+    '''Like _cell_partials(), but from the halo H: centered differences
+    also at block faces, with the ghost cells holding the values of the
+    neighbor (copied, restricted or prolongated). One-sided at faces on the
+    domain boundary (faces, see _domain_faces()).'''
+
+    nI = H.shape[1] - 2
+    nJ = H.shape[2] - 2
+    nK = H.shape[3] - 2
+    xlo, xhi, ylo, yhi, zlo, zhi = faces
+
+    # Cell (i, j, k) is at (i+1, j+1, k+1) in the halo
+    ih, jh, kh = i+1, j+1, k+1
+
+    if i == 0 and xlo:
+        ddx = (H[iVar, 2, jh, kh, iBlockP] - H[iVar, 1, jh, kh, iBlockP])/dx
+    elif i == nI-1 and xhi:
+        ddx = (H[iVar, nI, jh, kh, iBlockP] - H[iVar, nI-1, jh, kh, iBlockP])/dx
+    else:
+        ddx = (H[iVar, ih+1, jh, kh, iBlockP] - H[iVar, ih-1, jh, kh, iBlockP])/(2*dx)
+
+    if j == 0 and ylo:
+        ddy = (H[iVar, ih, 2, kh, iBlockP] - H[iVar, ih, 1, kh, iBlockP])/dy
+    elif j == nJ-1 and yhi:
+        ddy = (H[iVar, ih, nJ, kh, iBlockP] - H[iVar, ih, nJ-1, kh, iBlockP])/dy
+    else:
+        ddy = (H[iVar, ih, jh+1, kh, iBlockP] - H[iVar, ih, jh-1, kh, iBlockP])/(2*dy)
+
+    if k == 0 and zlo:
+        ddz = (H[iVar, ih, jh, 2, iBlockP] - H[iVar, ih, jh, 1, iBlockP])/dz
+    elif k == nK-1 and zhi:
+        ddz = (H[iVar, ih, jh, nK, iBlockP] - H[iVar, ih, jh, nK-1, iBlockP])/dz
+    else:
+        ddz = (H[iVar, ih, jh, kh+1, iBlockP] - H[iVar, ih, jh, kh-1, iBlockP])/(2*dz)
+
+    return ddx, ddy, ddz
+
+@numba.njit
+def _partials(DA, H, across_blocks, iVar, i, j, k, iBlockP, dx, dy, dz, faces):
+    if across_blocks:
+        return _halo_partials(H, iVar, i, j, k, iBlockP, dx, dy, dz, faces)
+    return _cell_partials(DA, iVar, i, j, k, iBlockP, dx, dy, dz)
+
+@numba.njit
+def _check_halo(batsclass, across_blocks):
+    if across_blocks and batsclass.halo.size == 0:
+        raise RuntimeError('across_blocks requires the halo; see build_halo()')
+
+@numba.njit
+def _cell_array(DA):
+    '''Uninitialized float32 array shaped like DA[iVar], (nI, nJ, nK,
+    nBlock), in Fortran order like data_arr, so that out.ravel(order='F')
+    is in the order of the rows of data_arr.'''
+    nVar, nI, nJ, nK, nBlock = DA.shape
+    return np.empty((nBlock, nK, nJ, nI), dtype=np.float32).T
+
+@numba.njit(parallel=True)
+def _gradient(batsclass, across_blocks, iVar, ddx, ddy, ddz):
+
+    _x = batsclass.varidx['x']
+    _y = batsclass.varidx['y']
+    _z = batsclass.varidx['z']
+
+    DA = batsclass.DataArray
+    H = batsclass.halo
+    nVar, nI, nJ, nK, nBlock = DA.shape
+
+    for iBlockP in numba.prange(nBlock):
+        dx, dy, dz = _grid_spacing(DA, _x, _y, _z, iBlockP)
+        faces = _domain_faces(batsclass, DA, _x, _y, _z, iBlockP, dx, dy, dz)
+        for k in range(nK):
+            for j in range(nJ):
+                for i in range(nI):
+                    ddx[i, j, k, iBlockP], ddy[i, j, k, iBlockP], ddz[i, j, k, iBlockP] = \
+                        _partials(DA, H, across_blocks, iVar, i, j, k, iBlockP, dx, dy, dz, faces)
+
+@numba.njit(parallel=True)
+def _curl(batsclass, across_blocks, iVx, iVy, iVz, cx, cy, cz):
+
+    _x = batsclass.varidx['x']
+    _y = batsclass.varidx['y']
+    _z = batsclass.varidx['z']
+
+    DA = batsclass.DataArray
+    H = batsclass.halo
+    nVar, nI, nJ, nK, nBlock = DA.shape
+
+    for iBlockP in numba.prange(nBlock):
+        dx, dy, dz = _grid_spacing(DA, _x, _y, _z, iBlockP)
+        faces = _domain_faces(batsclass, DA, _x, _y, _z, iBlockP, dx, dy, dz)
+        for k in range(nK):
+            for j in range(nJ):
+                for i in range(nI):
+                    dVxdx, dVxdy, dVxdz = _partials(DA, H, across_blocks, iVx, i, j, k, iBlockP, dx, dy, dz, faces)
+                    dVydx, dVydy, dVydz = _partials(DA, H, across_blocks, iVy, i, j, k, iBlockP, dx, dy, dz, faces)
+                    dVzdx, dVzdy, dVzdz = _partials(DA, H, across_blocks, iVz, i, j, k, iBlockP, dx, dy, dz, faces)
+                    cx[i, j, k, iBlockP] = dVzdy - dVydz
+                    cy[i, j, k, iBlockP] = dVxdz - dVzdx
+                    cz[i, j, k, iBlockP] = dVydx - dVxdy
+
+@numba.njit(parallel=True)
+def _divergence(batsclass, across_blocks, iVx, iVy, iVz, div):
+
+    _x = batsclass.varidx['x']
+    _y = batsclass.varidx['y']
+    _z = batsclass.varidx['z']
+
+    DA = batsclass.DataArray
+    H = batsclass.halo
+    nVar, nI, nJ, nK, nBlock = DA.shape
+
+    for iBlockP in numba.prange(nBlock):
+        dx, dy, dz = _grid_spacing(DA, _x, _y, _z, iBlockP)
+        faces = _domain_faces(batsclass, DA, _x, _y, _z, iBlockP, dx, dy, dz)
+        for k in range(nK):
+            for j in range(nJ):
+                for i in range(nI):
+                    dVxdx, dVxdy, dVxdz = _partials(DA, H, across_blocks, iVx, i, j, k, iBlockP, dx, dy, dz, faces)
+                    dVydx, dVydy, dVydz = _partials(DA, H, across_blocks, iVy, i, j, k, iBlockP, dx, dy, dz, faces)
+                    dVzdx, dVzdy, dVzdz = _partials(DA, H, across_blocks, iVz, i, j, k, iBlockP, dx, dy, dz, faces)
+                    div[i, j, k, iBlockP] = dVxdx + dVydy + dVzdz
+
 spec = [
             ('nDim'      , numba.types.int32    ),
             ('nI'        , numba.types.int32    ),
@@ -48,7 +688,37 @@ spec = [
 
             ('block2node', numba.types.int32[:]     ),
             ('node2block', numba.types.int32[:]     ),
-            ('file'      , numba.types.unicode_type )
+            ('file'      , numba.types.unicode_type ),
+
+            # Optional acceleration structure; see build_lookup_grid()
+            ('lookup_grid', numba.types.int32[:,:,:] ),
+            ('lookup_dx'  , numba.types.float64      ),
+            ('lookup_dy'  , numba.types.float64      ),
+            ('lookup_dz'  , numba.types.float64      ),
+
+            # Optional linear octree of leaves; see build_morton_index()
+            ('morton_keys' , numba.types.uint64[:]  ),
+            ('morton_nodes', numba.types.int32[:]   ),
+            ('morton_n'    , numba.types.int64[:]   ),
+            ('morton_dx'   , numba.types.float64    ),
+            ('morton_dy'   , numba.types.float64    ),
+            ('morton_dz'   , numba.types.float64    ),
+
+            # Optional copy of DataArray with one layer of ghost cells; see
+            # build_halo()
+            ('halo_arr'    , numba.types.float32[:,:]         ),
+            ('halo'        , numba.types.float32[:,:,:,:,:] ),
+
+            # Index in the file of each block, if the blocks were
+            # reordered by reorder_blocks(); empty otherwise
+            ('block_file_order', numba.types.int32[:] ),
+
+            # Radius of the inner boundary; 0 if none
+            ('rBody'       , numba.types.float64 ),
+
+            # Optional neighbor table; see build_neighbors()
+            ('neighbor_dlevel', numba.types.int8[:,:,:,:]    ),
+            ('neighbor_blocks', numba.types.int32[:,:,:,:,:] ),
         ]
 
 
@@ -120,6 +790,32 @@ class BatsrusClass:
         self.node2block        = node2block
         self.file              = file
 
+        self.lookup_grid       = np.zeros((0, 0, 0), dtype=np.int32)
+        self.lookup_dx         = 0.
+        self.lookup_dy         = 0.
+        self.lookup_dz         = 0.
+
+        self.morton_keys       = np.zeros(0, dtype=np.uint64)
+        self.morton_nodes      = np.zeros(0, dtype=np.int32)
+        self.morton_n          = np.zeros(3, dtype=np.int64)
+        self.morton_dx         = 0.
+        self.morton_dy         = 0.
+        self.morton_dz         = 0.
+
+        self.halo_arr          = np.zeros((0, 0), dtype=np.float32)
+        self.halo              = np.zeros((0, 0, 0, 0, 0), dtype=np.float32)
+
+        self.block_file_order  = np.zeros(0, dtype=np.int32)
+
+        self.rBody             = 0.
+
+        self.neighbor_dlevel   = np.zeros((0, 0, 0, 0), dtype=np.int8)
+        self.neighbor_blocks   = np.zeros((0, 0, 0, 0, 0), dtype=np.int32)
+
+        if block2node.size > 0 and block2node[0] >= 0:
+            # block2node and node2block were passed in already populated
+            # (e.g., by attach_shared()); measure is then already in DataArray.
+            return
 
         #import swmfio # (Can't use with njit enabled)
         # map blocks <=> nodes for interpolation; add volume variable
@@ -184,6 +880,16 @@ class BatsrusClass:
         if not (xin and yin and zin): 
             raise RuntimeError('point out of simulation volume')
 
+        if self.lookup_grid.size > 0:
+            iNode = _lookup_grid_node(self, point)
+            # Rounding can put a point that is on or very near a face in
+            # the neighboring grid cell; search from the root nodes then.
+            if _node_contains(self, iNode, point):
+                return _descend_tree(self, iNode, point)
+
+        if self.morton_keys.size > 0:
+            return _morton_find_node(self, point)
+
         found = False
         if debug:
             if len(amr_level_0_nodes) > 0:
@@ -213,35 +919,7 @@ class BatsrusClass:
         if debug:
             print(f"Root node for this point: {iNode}")
 
-        while True:
-            if self.block_child_count[F2P(iNode)] == 0:
-                if debug:
-                    print(f"Node {iNode} does not have children. Done.")
-                break
-
-            found = False
-            for j in range(self.block_child_count[F2P(iNode)]):
-                if debug:
-                    print(f"Checking iNode {iNode} child {j+1}/{self.block_child_count[F2P(iNode)]}")
-                child = self.block_child_ids[j, F2P(iNode)]
-                if debug:
-                    print(f"x = {point[0]} block_x_min = {self.block_x_min[F2P(child)]} block_x_max = {self.block_x_max[F2P(child)]}")
-                    print(f"y = {point[1]} block_y_min = {self.block_y_min[F2P(child)]} block_y_max = {self.block_y_max[F2P(child)]}")
-                    print(f"z = {point[2]} block_z_min = {self.block_y_min[F2P(child)]} block_z_max = {self.block_y_max[F2P(child)]}")
-
-                xin = self.block_x_min[F2P(child)] <= point[0] <= self.block_x_max[F2P(child)]
-                yin = self.block_y_min[F2P(child)] <= point[1] <= self.block_y_max[F2P(child)]
-                zin = self.block_z_min[F2P(child)] <= point[2] <= self.block_z_max[F2P(child)]
-
-                if xin and yin and zin:
-                    if debug:
-                        print(f"Found node for given point.")
-                    found = True
-                    iNode = child
-                    break
-
-            # TODO: Add check for max depth to prevent loop from never ending.
-        return iNode
+        return _descend_tree(self, iNode, point)
 
 
     def interpolate(self, point, var):
@@ -251,93 +929,221 @@ class BatsrusClass:
         _z = self.varidx['z']
         iVar = self.varidx[var]
 
-        DA = self.DataArray
-        nVar, nI, nJ, nK, nBlock = DA.shape
+        DA = _values(self)
 
         iNode = self.find_tree_node(point)
         iBlockP = self.node2block[F2P(iNode)]
 
-        # get the gridspacing in x,y,z
-        gridspacingX = DA[_x,1,0,0,iBlockP] - DA[_x,0,0,0,iBlockP]
-        gridspacingY = DA[_y,0,1,0,iBlockP] - DA[_y,0,0,0,iBlockP]
-        gridspacingZ = DA[_z,0,0,1,iBlockP] - DA[_z,0,0,0,iBlockP]
-
-        # i0 is s.t. the highest index s.t. the x coordinate of the 
-        #  corresponding cell block_data[iNode,i0,:,:]  is still less than point[0]
-        i0 = (point[0] - DA[_x, 0, 0, 0, iBlockP])/gridspacingX
-        j0 = (point[1] - DA[_y, 0, 0, 0, iBlockP])/gridspacingY
-        k0 = (point[2] - DA[_z, 0, 0, 0, iBlockP])/gridspacingZ
-        #if i0.is_integer() and j0.is_integer() and k0.is_integer(): # doesnt work in numba
-        #    is_native = True
-        #    print( (iBlockP,int(i0),int(j0),int(k0)) )# (iBlockP,i,j,k)
-        #    i0 = int(i0)
-        #    j0 = int(j0)
-        #    k0 = int(k0)
-        i0 = int(np.floor(i0))
-        j0 = int(np.floor(j0))
-        k0 = int(np.floor(k0))
-
-        # i1 = i0+1 is the lowest index s.t. the x coordinate of the 
-        #  corresponding cell block_data[iNode,i1,:,:]  is still greater than point[0]
-        # together, i0 and i1 form the upper and lower bounds for a linear interpolation in x
-        # likewise for j0,j1,y  and k0,k1,z
-
-        # TODO: implement better interpolation at ends of block.
-        # This method effectively makes it nearest neighbor at the ends
-        if i0 == -1:
-            i0 = 0
-            i1 = 0
-        elif i0 == nI-1:
-            i1 = nI-1
-        else:
-            i1 = i0 + 1
-
-        if j0 == -1:
-            j0 = 0
-            j1 = 0
-        elif j0 == nJ-1:
-            j1 = nJ-1
-        else:
-            j1 = j0 + 1
-
-        if k0 == -1:
-            k0 = 0
-            k1 = 0
-        elif k0 == nK-1:
-            k1 = nK-1
-        else:
-            k1 = k0 + 1
-
-        # all together i0,i1,j0, etc... form a cube of side length "gridpacing"
-        # To do trilinear interpolation within, define xd as the distance
-        # along x of point within that cube, in units of "gridspacing"
-        xd = (point[0] - DA[_x, i0, 0 , 0 , iBlockP])/gridspacingX
-        yd = (point[1] - DA[_y, 0 , j0, 0 , iBlockP])/gridspacingY
-        zd = (point[2] - DA[_z, 0 , 0 , k0, iBlockP])/gridspacingZ
-
-        #https://en.wikipedia.org/wiki/Trilinear_interpolation
-        c000 = DA[iVar,  i0, j0, k0,  iBlockP]
-        c001 = DA[iVar,  i0, j0, k1,  iBlockP]
-        c010 = DA[iVar,  i0, j1, k0,  iBlockP]
-        c100 = DA[iVar,  i1, j0, k0,  iBlockP]
-        c011 = DA[iVar,  i0, j1, k1,  iBlockP]
-        c110 = DA[iVar,  i1, j1, k0,  iBlockP]
-        c101 = DA[iVar,  i1, j0, k1,  iBlockP]
-        c111 = DA[iVar,  i1, j1, k1,  iBlockP]
-
-        c00 = c000*(1.-xd) + c100*xd
-        c01 = c001*(1.-xd) + c101*xd
-        c10 = c010*(1.-xd) + c110*xd
-        c11 = c011*(1.-xd) + c111*xd
-
-        c0 = c00*(1.-yd) + c10*yd
-        c1 = c01*(1.-yd) + c11*yd
-
-        c = c0*(1.-zd) + c1*zd
-        return c
-
-
-    def get_native_partial_derivatives(self, indx, var):
+        i0, i1, j0, j1, k0, k1, xd, yd, zd = _stencil(self, _x, _y, _z, iBlockP, point)
+
+        return _trilinear(DA, iVar, iBlockP, i0, i1, j0, j1, k0, k1, xd, yd, zd)
+
+
+    def interpolate_with_gradient(self, point, var):
+        '''Interpolated value of var at point and its gradient, a length-3
+        array, from the derivatives of the trilinear interpolant.'''
+
+        points = point.reshape((1, 3))
+        _check_in_domain(self, points)
+
+        iVars = _var_indices(self.varidx, (var,))
+
+        values, gradients, status = _interpolate_many_gradient_ivars(self, points, iVars, np.nan, 0., False)
+
+        return values[0, 0], gradients[0, 0]
+
+
+    def interpolate_many_with_gradient(self, points, var, fill=np.nan, sort=False):
+        '''interpolate_with_gradient() for each row of points. Returns the
+        values, shape (N,), and gradients, shape (N, 3). Both are fill for
+        points outside of the domain. For the status of each point, use
+        interpolate_many_with_gradient_masked().'''
+
+        iVars = _var_indices(self.varidx, (var,))
+
+        values, gradients, status = _interpolate_many_gradient_ivars(self, points, iVars, fill, 0., sort)
+
+        return values[:, 0], gradients[:, 0, :]
+
+
+    def interpolate_many_with_gradient_masked(self, points, var, fill=np.nan, sort=False):
+        '''Like interpolate_many_with_gradient(), but points inside the inner
+        boundary are also not interpolated, as in
+        interpolate_many_vars_masked(). Returns the values, gradients, mask
+        and status of each point.'''
+
+        iVars = _var_indices(self.varidx, (var,))
+
+        values, gradients, status = _interpolate_many_gradient_ivars(self, points, iVars, fill, self.rBody, sort)
+
+        return values[:, 0], gradients[:, 0, :], status == PointOk_, status
+
+
+    def interpolate_many_vars_with_gradient(self, points, variables, fill=np.nan, sort=False):
+        '''interpolate_with_gradient() for each of variables (a tuple of
+        names) at each row of points. Returns the values, shape (N, nvars),
+        and gradients, shape (N, nvars, 3); e.g., for ('bx', 'by', 'bz'),
+        gradients[n] is the Jacobian of B at points[n]. Both are fill for
+        points outside of the domain. For the status of each point, use
+        interpolate_many_vars_with_gradient_masked().'''
+
+        iVars = _var_indices(self.varidx, variables)
+
+        values, gradients, status = _interpolate_many_gradient_ivars(self, points, iVars, fill, 0., sort)
+
+        return values, gradients
+
+
+    def interpolate_many_vars_with_gradient_masked(self, points, variables, fill=np.nan, sort=False):
+        '''Like interpolate_many_vars_with_gradient(), but points inside the
+        inner boundary are also not interpolated, as in
+        interpolate_many_vars_masked(). Returns the values, gradients, mask
+        and status of each point.'''
+
+        iVars = _var_indices(self.varidx, variables)
+
+        values, gradients, status = _interpolate_many_gradient_ivars(self, points, iVars, fill, self.rBody, sort)
+
+        return values, gradients, status == PointOk_, status
+
+
+    def plan(self, points, sort=False, masked=False):
+        '''Locate each row of points and compute its interpolation weights
+        once, for use with InterpolationPlan.apply() on this and later
+        snapshots of a run with the same grid. The status of each point is
+        the status attribute of the plan. If masked is True, points inside
+        the inner boundary are not interpolated, as in
+        interpolate_many_vars_masked().'''
+
+        rbody = self.rBody if masked else 0.
+
+        cells = np.empty((points.shape[0], 8), dtype=np.int64)
+        weights = np.empty((points.shape[0], 8), dtype=np.float64)
+        status = np.empty(points.shape[0], dtype=np.int8)
+        _fill_plan(self, points, _query_order(self, points, sort), cells, weights, status, rbody)
+
+        return InterpolationPlan(cells, weights, status, self.halo.size > 0, _values_arr(self).shape[0], self)
+
+
+    def find_tree_nodes(self, points):
+        '''find_tree_node() for each row of points, an (N, 3) array. Points
+        are processed in parallel.'''
+
+        _check_in_domain(self, points)
+
+        nodes = np.empty(points.shape[0], dtype=np.int32)
+        _find_tree_nodes(self, points, nodes)
+
+        return nodes
+
+
+    def interpolate_many(self, points, var, fill=np.nan, sort=False):
+        '''Interpolate var at each row of points, an (N, 3) array. Points are
+        processed in parallel; the result is identical to calling interpolate()
+        for each point, except that points outside of the domain give fill
+        instead of an exception.
+
+        If sort is True, points are processed in Morton (Z-curve) order of
+        their positions, which for many points in random order (e.g.,
+        random samples of a large snapshot) makes consecutive points use
+        the same blocks of DataArray. Results are in the order of points
+        either way. The other batch methods take the same argument.
+
+        For the status of each point, use interpolate_many_masked().'''
+
+        iVars = _var_indices(self.varidx, (var,))
+
+        out, status = _interpolate_many_ivars(self, points, iVars, fill, 0., sort)
+
+        return out[:, 0]
+
+
+    def interpolate_many_masked(self, points, var, fill=np.nan, sort=False):
+        '''Like interpolate_many(), but points inside the inner boundary are
+        also not interpolated, as in interpolate_many_vars_masked(). Returns
+        the (N,) values, mask and status of each point.'''
+
+        iVars = _var_indices(self.varidx, (var,))
+
+        out, status = _interpolate_many_ivars(self, points, iVars, fill, self.rBody, sort)
+
+        return out[:, 0], status == PointOk_, status
+
+
+    def interpolate_many_vars(self, points, variables, fill=np.nan, sort=False):
+        '''Interpolate each of variables (a tuple of names, e.g.,
+        ('bx', 'by', 'bz')) at each row of points. Returns an (N, nvars)
+        array. The cell search and trilinear weights are shared by all
+        variables. Rows for points outside of the domain are fill. For the
+        status of each point, use interpolate_many_vars_masked().'''
+
+        iVars = _var_indices(self.varidx, variables)
+
+        out, status = _interpolate_many_ivars(self, points, iVars, fill, 0., sort)
+
+        return out
+
+
+    def interpolate_many_vars_masked(self, points, variables, fill=np.nan, sort=False):
+        '''Like interpolate_many_vars(), but points inside the inner
+        boundary (radius rBody, if the file has it) are also not
+        interpolated. Returns the (N, nvars) values, a boolean mask that is
+        True for interpolated points, and the status of each point:
+        PointOk_, PointOutside_ or PointInBody_ (see swmfio.constants).'''
+
+        iVars = _var_indices(self.varidx, variables)
+
+        out, status = _interpolate_many_ivars(self, points, iVars, fill, self.rBody, sort)
+
+        return out, status == PointOk_, status
+
+
+    def cell_index(self, points):
+        '''Cell that contains each row of points. Returns an (N, 4) array
+        with columns iBlockP, i, j and k, and the flat index of each cell,
+        i + nI*j + nI*nJ*k + nI*nJ*nK*iBlockP, which is the row of data_arr
+        and the indx argument of get_native_partial_derivatives(). Both
+        are -1 for points outside of the domain.'''
+
+        cells = np.empty((points.shape[0], 4), dtype=np.int32)
+        indx = np.empty(points.shape[0], dtype=np.int64)
+        _cell_index(self, points, cells, indx)
+
+        return cells, indx
+
+
+    def get_native_values(self, indx, variables):
+        '''Stored values of each of variables (a tuple of names) in the
+        cells with flat indices indx (see cell_index()); an (N, nvars)
+        array, NaN where indx is -1.'''
+
+        iVars = _var_indices(self.varidx, variables)
+
+        out = np.empty((indx.size, iVars.size), dtype=np.float64)
+        _gather(self.data_arr, indx, iVars, out)
+
+        return out
+
+
+    def cell_values(self, points, variables):
+        '''Stored values of each of variables in the cell that contains
+        each row of points. For points on cell centers, this is what
+        interpolate_many_vars() gives, but with no interpolation.'''
+
+        cells, indx = self.cell_index(points)
+
+        return self.get_native_values(indx, variables)
+
+
+    def get_native_partial_derivatives(self, indx, var, across_blocks=False):
+        '''Partial derivatives of var at the cell with flat index indx (see
+        cell_index()). Differences are centered inside the block and
+        one-sided at its faces; with across_blocks, also centered at faces
+        that are not on the domain boundary, using the values of the
+        neighbor blocks in the halo (see build_halo()).'''
+
+        _check_halo(self, across_blocks)
+
         _x = self.varidx['x']
         _y = self.varidx['y']
         _z = self.varidx['z']
@@ -351,38 +1157,731 @@ class BatsrusClass:
 
         partials = np.empty(3, dtype=np.float32)
 
-        epsilonX = DA[_x,1,0,0,iBlockP] - DA[_x,0,0,0,iBlockP]
-        epsilonY = DA[_y,0,1,0,iBlockP] - DA[_y,0,0,0,iBlockP]
-        epsilonZ = DA[_z,0,0,1,iBlockP] - DA[_z,0,0,0,iBlockP]
-
-        if i == 0:
-            partials[0] = (DA[iVar, 1, j, k , iBlockP] - DA[iVar, 0, j, k, iBlockP])/(epsilonX)
-        elif i == nI-1:
-            partials[0] = (DA[iVar, nI-1, j, k, iBlockP] - DA[iVar, nI-2, j, k, iBlockP])/(epsilonX)
-        else:
-            partials[0] = (DA[iVar, i+1, j  , k, iBlockP] - DA[iVar, i-1, j, k, iBlockP])/(2*epsilonX)
-
-        if j == 0:
-            partials[1] = (DA[iVar, i, 1, k, iBlockP] - DA[iVar, i, 0, k, iBlockP])/(epsilonY)
-        elif j == nJ-1:
-            partials[1] = (DA[iVar, i, nJ-1, k, iBlockP] - DA[iVar, i, nJ-2, k, iBlockP])/(epsilonY)
-        else:
-            partials[1] = (DA[iVar, i, j+1, k, iBlockP] - DA[iVar, i, j-1, k, iBlockP])/(2*epsilonY)
-
-        if k == 0:
-            partials[2] = (DA[iVar, i, j, 1, iBlockP] - DA[iVar, i, j, 0, iBlockP])/(epsilonZ)
-        elif k == nK-1:
-            partials[2] = (DA[iVar, i, j, nK-1, iBlockP] - DA[iVar, i, j, nK-2, iBlockP])/(epsilonZ)
-        else:
-            partials[2] = (DA[iVar, i, j, k+1, iBlockP] - DA[iVar, i, j, k-1, iBlockP])/(2*epsilonZ)
+        epsilonX, epsilonY, epsilonZ = _grid_spacing(DA, _x, _y, _z, iBlockP)
+        faces = _domain_faces(self, DA, _x, _y, _z, iBlockP, epsilonX, epsilonY, epsilonZ)
+        partials[0], partials[1], partials[2] = \
+            _partials(DA, self.halo, across_blocks, iVar, i, j, k, iBlockP, epsilonX, epsilonY, epsilonZ, faces)
 
         return partials
 
 
-def get_class_from_native(file):
+    def gradient(self, var, across_blocks=False):
+        '''Partial derivatives of var in every cell, computed as
+        get_native_partial_derivatives() does (with across_blocks, from the
+        halo), with blocks processed in parallel. Returns (ddx, ddy, ddz),
+        each a float32 array shaped like DataArray[var].'''
+
+        _check_halo(self, across_blocks)
+
+        ddx = _cell_array(self.DataArray)
+        ddy = _cell_array(self.DataArray)
+        ddz = _cell_array(self.DataArray)
+        _gradient(self, across_blocks, self.varidx[var], ddx, ddy, ddz)
+
+        return ddx, ddy, ddz
+
+
+    def curl(self, vx, vy, vz, across_blocks=False):
+        '''Curl of the vector with components vx, vy, vz (e.g., 'bx', 'by',
+        'bz') in every cell. Returns the three components, each a float32
+        array shaped like DataArray[vx]. See gradient() for
+        across_blocks.'''
+
+        _check_halo(self, across_blocks)
+
+        cx = _cell_array(self.DataArray)
+        cy = _cell_array(self.DataArray)
+        cz = _cell_array(self.DataArray)
+        _curl(self, across_blocks, self.varidx[vx], self.varidx[vy], self.varidx[vz], cx, cy, cz)
+
+        return cx, cy, cz
+
+
+    def divergence(self, vx, vy, vz, across_blocks=False):
+        '''Divergence of the vector with components vx, vy, vz in every
+        cell; a float32 array shaped like DataArray[vx]. See gradient() for
+        across_blocks.'''
 
-    iTree_IA, iRatio_D, nRoot_D, info = read_tree(file)
-    data_arr, variables, meta = read_data(file)
+        _check_halo(self, across_blocks)
+
+        div = _cell_array(self.DataArray)
+        _divergence(self, across_blocks, self.varidx[vx], self.varidx[vy], self.varidx[vz], div)
+
+        return div
+
+
+locator_spec = [
+            ('batsclass'  , BatsrusClass.class_type.instance_type ),
+            ('hint'       , numba.types.int32 ),
+            ('hits'       , numba.types.int64 ),
+            ('parent_hits', numba.types.int64 ),
+            ('misses'     , numba.types.int64 ),
+        ]
+
+
+@numba.experimental.jitclass(locator_spec)
+class BlockLocator:
+    '''Point location for sequences of nearby points (field line tracing,
+    trajectories). The leaf found for the previous point is tested first,
+    then its parent's subtree, before a full search from the root nodes.
+    Use one instance per caller or thread; instances are not thread safe.'''
+
+    def __init__(self, batsclass):
+        self.batsclass   = batsclass
+        self.hint        = -1
+        self.hits        = 0
+        self.parent_hits = 0
+        self.misses      = 0
+
+    def find_tree_node(self, point):
+
+        iNode = self.hint
+        if iNode > 0:
+            if _node_contains(self.batsclass, iNode, point):
+                self.hits += 1
+                return iNode
+
+            iParent = self.batsclass.block_parent_id[F2P(iNode)]
+            if iParent > 0 and _node_contains(self.batsclass, iParent, point):
+                self.parent_hits += 1
+                self.hint = _descend_tree(self.batsclass, iParent, point)
+                return self.hint
+
+        self.misses += 1
+        self.hint = self.batsclass.find_tree_node(point)
+        return self.hint
+
+    def interpolate(self, point, var):
+
+        batsclass = self.batsclass
+        DA = _values(batsclass)
+        _x = batsclass.varidx['x']
+        _y = batsclass.varidx['y']
+        _z = batsclass.varidx['z']
+
+        iNode = self.find_tree_node(point)
+        iBlockP = batsclass.node2block[F2P(iNode)]
+
+        i0, i1, j0, j1, k0, k1, xd, yd, zd = _stencil(batsclass, _x, _y, _z, iBlockP, point)
+
+        return _trilinear(DA, batsclass.varidx[var], iBlockP, i0, i1, j0, j1, k0, k1, xd, yd, zd)
+
+    def interpolate_many_vars(self, points, variables):
+        '''Like BatsrusClass.interpolate_many_vars(), but points are
+        processed in order (not in parallel) so that each search starts from
+        the block of the previous point.'''
+
+        batsclass = self.batsclass
+        DA = _values(batsclass)
+        _x = batsclass.varidx['x']
+        _y = batsclass.varidx['y']
+        _z = batsclass.varidx['z']
+
+        iVars = _var_indices(batsclass.varidx, variables)
+
+        out = np.empty((points.shape[0], iVars.size), dtype=np.float64)
+        for n in range(points.shape[0]):
+            iNode = self.find_tree_node(points[n])
+            iBlockP = batsclass.node2block[F2P(iNode)]
+            i0, i1, j0, j1, k0, k1, xd, yd, zd = _stencil(batsclass, _x, _y, _z, iBlockP, points[n])
+            for v in range(iVars.size):
+                out[n, v] = _trilinear(DA, iVars[v], iBlockP, i0, i1, j0, j1, k0, k1, xd, yd, zd)
+
+        return out
+
+    def hit_rate(self):
+        '''Fraction of searches answered by the previous leaf or its parent.'''
+        total = self.hits + self.parent_hits + self.misses
+        if total == 0:
+            return 0.
+        return (self.hits + self.parent_hits)/total
+
+
+plan_spec = [
+            ('cells'    , numba.types.int64[:,:]   ),
+            ('weights'  , numba.types.float64[:,:] ),
+            ('status'   , numba.types.int8[:]      ),
+            ('uses_halo', numba.types.boolean      ),
+            ('nCell'    , numba.types.int64        ),
+            # Grid the plan was created on (see batsrus_spacetime.same_grid())
+            ('block2node'      , numba.types.int32[:]   ),
+            ('block_amr_levels', numba.types.int32[:]   ),
+            ('block_x_min'     , numba.types.float32[:] ),
+            ('block_y_min'     , numba.types.float32[:] ),
+            ('block_z_min'     , numba.types.float32[:] ),
+        ]
+
+
+@numba.experimental.jitclass(plan_spec)
+class InterpolationPlan:
+    '''Interpolation at fixed points (e.g., virtual satellites or the
+    points of a regular grid) as a sparse operator: for each point, the
+    rows of the eight cells it is interpolated from and their weights.
+    Created by BatsrusClass.plan(). Applying it is a gather and
+    multiply-add per point; there is no point location.
+
+    A plan can be applied to any snapshot that has the same grid as the
+    one it was created from: the same tree and blocks in the same order
+    (and, if that one had a halo, also a halo). Otherwise apply() raises
+    RuntimeError.
+    Points outside of the domain have status PointOutside_ and give the
+    fill value, as do points inside the inner boundary (PointInBody_) of a
+    plan created with masked=True.'''
+
+    def __init__(self, cells, weights, status, uses_halo, nCell, grid):
+        self.cells     = cells
+        self.weights   = weights
+        self.status    = status
+        self.uses_halo = uses_halo
+        self.nCell     = nCell
+        self.block2node       = grid.block2node.copy()
+        self.block_amr_levels = grid.block_amr_levels.copy()
+        self.block_x_min      = grid.block_x_min.copy()
+        self.block_y_min      = grid.block_y_min.copy()
+        self.block_z_min      = grid.block_z_min.copy()
+
+    def _check(self, snapshot):
+        if (snapshot.halo.size > 0) != self.uses_halo or _values_arr(snapshot).shape[0] != self.nCell:
+            raise RuntimeError('snapshot grid does not match the plan')
+        # Same number of cells, but another tree or block order
+        if not (np.array_equal(snapshot.block2node, self.block2node)
+                and np.array_equal(snapshot.block_amr_levels, self.block_amr_levels)
+                and np.array_equal(snapshot.block_x_min, self.block_x_min)
+                and np.array_equal(snapshot.block_y_min, self.block_y_min)
+                and np.array_equal(snapshot.block_z_min, self.block_z_min)):
+            raise RuntimeError('snapshot grid does not match the plan')
+
+    def apply(self, snapshot, var, fill=np.nan):
+        '''Values of var at the points of the plan in snapshot; fill where
+        the status attribute of the plan is not PointOk_.'''
+
+        self._check(snapshot)
+        iVars = _var_indices(snapshot.varidx, (var,))
+
+        out = np.empty((self.cells.shape[0], 1), dtype=np.float64)
+        _apply_plan(self.cells, self.weights, self.status, _values_arr(snapshot), iVars, fill, out)
+
+        return out[:, 0]
+
+    def apply_vars(self, snapshot, variables, fill=np.nan):
+        '''Values of each of variables (a tuple of names) at the points of
+        the plan in snapshot; an (N, nvars) array. As with apply(), the
+        status of each point is in the status attribute of the plan.'''
+
+        self._check(snapshot)
+        iVars = _var_indices(snapshot.varidx, variables)
+
+        out = np.empty((self.cells.shape[0], iVars.size), dtype=np.float64)
+        _apply_plan(self.cells, self.weights, self.status, _values_arr(snapshot), iVars, fill, out)
+
+        return out
+
+
+def _root_layout(batsclass):
+    '''Size of the root blocks, dx0, dy0 and dz0, and the number of root
+    blocks in each dimension, nRoot.'''
+
+    iRoot = batsclass.amr_level_0_nodes[0]
+    dx0 = batsclass.block_x_max[F2P(iRoot)] - batsclass.block_x_min[F2P(iRoot)]
+    dy0 = batsclass.block_y_max[F2P(iRoot)] - batsclass.block_y_min[F2P(iRoot)]
+    dz0 = batsclass.block_z_max[F2P(iRoot)] - batsclass.block_z_min[F2P(iRoot)]
+
+    nRoot = np.array([
+                        round((batsclass.xGlobalMax - batsclass.xGlobalMin)/dx0),
+                        round((batsclass.yGlobalMax - batsclass.yGlobalMin)/dy0),
+                        round((batsclass.zGlobalMax - batsclass.zGlobalMin)/dz0)
+                    ], dtype=np.int64)
+
+    return dx0, dy0, dz0, nRoot
+
+
+def build_lookup_grid(batsclass, max_bytes=2**28):
+    '''Build a uniform grid that maps a point directly to a tree node, so
+    that find_tree_node() (and everything that uses it) skips most or all of
+    the tree descent.
+
+    The grid spacing is the size of the finest blocks, or of the blocks at
+    the finest level for which the grid fits in max_bytes. Each grid cell
+    stores the deepest node that contains it; this is a leaf unless the
+    grid is coarser than the finest blocks, in which case the remaining
+    levels are descended as before. If no level fits in max_bytes, no grid
+    is built and the tree is searched from the root nodes.
+
+    Returns the AMR level of the grid, or -1 if none was built.
+    '''
+
+    dx0, dy0, dz0, nRoot = _root_layout(batsclass)
+
+    iLevel = -1
+    for level in range(int(batsclass.block_amr_levels.max()) + 1):
+        if np.prod(nRoot*2**level)*np.dtype(np.int32).itemsize > max_bytes:
+            break
+        iLevel = level
+
+    if iLevel == -1:
+        swmfio.logger.info(f"Lookup grid does not fit in {max_bytes} bytes; not built")
+        batsclass.lookup_grid = np.zeros((0, 0, 0), dtype=np.int32)
+        return iLevel
+
+    shape = tuple(nRoot*2**iLevel)
+    swmfio.logger.info(f"Building lookup grid for level {iLevel} with shape {shape}")
+
+    batsclass.lookup_dx = float(dx0)/2**iLevel
+    batsclass.lookup_dy = float(dy0)/2**iLevel
+    batsclass.lookup_dz = float(dz0)/2**iLevel
+    batsclass.lookup_grid = _fill_lookup_grid(batsclass, np.zeros(shape, dtype=np.int32), iLevel)
+
+    return iLevel
+
+
+@numba.njit
+def _fill_lookup_grid(batsclass, grid, iLevel):
+
+    for iNodeP in range(batsclass.block_amr_levels.size):
+        level = batsclass.block_amr_levels[iNodeP]
+        is_leaf = batsclass.block_child_count[iNodeP] == 0
+        if level > iLevel or (level < iLevel and not is_leaf):
+            continue
+
+        i0 = int(round((batsclass.block_x_min[iNodeP] - batsclass.xGlobalMin)/batsclass.lookup_dx))
+        i1 = int(round((batsclass.block_x_max[iNodeP] - batsclass.xGlobalMin)/batsclass.lookup_dx))
+        j0 = int(round((batsclass.block_y_min[iNodeP] - batsclass.yGlobalMin)/batsclass.lookup_dy))
+        j1 = int(round((batsclass.block_y_max[iNodeP] - batsclass.yGlobalMin)/batsclass.lookup_dy))
+        k0 = int(round((batsclass.block_z_min[iNodeP] - batsclass.zGlobalMin)/batsclass.lookup_dz))
+        k1 = int(round((batsclass.block_z_max[iNodeP] - batsclass.zGlobalMin)/batsclass.lookup_dz))
+
+        grid[i0:i1, j0:j1, k0:k1] = P2F(iNodeP)
+
+    return grid
+
+
+def build_morton_index(batsclass):
+    '''Build a linear octree of the leaf blocks: their nodes sorted by the
+    Morton (Z-order) key of their minimum corner in units of the finest
+    cells. Leaves tile the domain, so each one covers the keys from its own
+    up to the next leaf's, and find_tree_node() becomes a key computation
+    and a binary search on two flat arrays (12 bytes per leaf) instead of a
+    walk through the per-node child and bounds arrays.
+
+    Keys use 21 bits per dimension, which allows for 2**21 finest cells
+    across the domain.
+
+    Returns the number of leaves.
+    '''
+
+    dx0, dy0, dz0, nRoot = _root_layout(batsclass)
+
+    iLevelMax = int(batsclass.block_amr_levels.max())
+    n = nRoot*2**iLevelMax
+    assert(np.all(n <= 2**21))
+
+    swmfio.logger.info(f"Building Morton index for {n} finest cells")
+
+    batsclass.morton_n = n
+    batsclass.morton_dx = float(dx0)/2**iLevelMax
+    batsclass.morton_dy = float(dy0)/2**iLevelMax
+    batsclass.morton_dz = float(dz0)/2**iLevelMax
+
+    keys, nodes = _morton_keys(batsclass)
+    order = np.argsort(keys, kind='stable')
+    batsclass.morton_keys = keys[order]
+    batsclass.morton_nodes = nodes[order]
+
+    return nodes.size
+
+
+def reorder_blocks(batsclass):
+    '''Permute the blocks of data_arr and DataArray (and the halo and
+    neighbor table, if built) into the Morton (Z-curve) order of their
+    positions, so that blocks that are close in space are close in memory.
+    block2node and node2block are updated, and block_file_order[iBlockP]
+    is the index in the file of block iBlockP, for writers that need the
+    original order. Builds the Morton index (build_morton_index()) if it
+    was not built.
+
+    data_arr is copied, so memory use temporarily doubles.
+    '''
+
+    if batsclass.morton_keys.size == 0:
+        build_morton_index(batsclass)
+
+    nBlock = batsclass.block2node.size
+    nVar = batsclass.data_arr.shape[1]
+    nI, nJ, nK = batsclass.nI, batsclass.nJ, batsclass.nK
+    swmfio.logger.info(f"Reordering {nBlock} blocks")
+
+    # Leaves in Morton order are the blocks in their new order
+    order = batsclass.node2block[batsclass.morton_nodes - 1]
+    assert(order.size == nBlock)
+
+    data_arr = batsclass.data_arr.reshape((nBlock, nI*nJ*nK, nVar))[order].reshape((-1, nVar))
+    batsclass.data_arr = data_arr
+    batsclass.DataArray = data_arr.transpose().reshape((nVar, nI, nJ, nK, nBlock), order='F')
+
+    block2node = batsclass.block2node[order]
+    node2block = batsclass.node2block.copy()
+    node2block[block2node] = np.arange(nBlock, dtype=np.int32)
+    batsclass.block2node = block2node
+    batsclass.node2block = node2block
+
+    if batsclass.block_file_order.size > 0:
+        batsclass.block_file_order = batsclass.block_file_order[order]
+    else:
+        batsclass.block_file_order = order.astype(np.int32)
+
+    if batsclass.halo.size > 0:
+        build_halo(batsclass)
+    if batsclass.neighbor_dlevel.size > 0:
+        build_neighbors(batsclass)
+
+
+@numba.njit
+def _morton_keys(batsclass):
+
+    nLeaf = 0
+    for iNodeP in range(batsclass.block_child_count.size):
+        if batsclass.block_child_count[iNodeP] == 0 and batsclass.node2block[iNodeP] >= 0:
+            nLeaf += 1
+
+    keys = np.empty(nLeaf, dtype=np.uint64)
+    nodes = np.empty(nLeaf, dtype=np.int32)
+
+    n = 0
+    for iNodeP in range(batsclass.block_child_count.size):
+        if batsclass.block_child_count[iNodeP] != 0 or batsclass.node2block[iNodeP] < 0:
+            continue
+        # Integer coordinates of the block corner at the finest level
+        ix = int(round((batsclass.block_x_min[iNodeP] - batsclass.xGlobalMin)/batsclass.morton_dx))
+        iy = int(round((batsclass.block_y_min[iNodeP] - batsclass.yGlobalMin)/batsclass.morton_dy))
+        iz = int(round((batsclass.block_z_min[iNodeP] - batsclass.zGlobalMin)/batsclass.morton_dz))
+        keys[n] = _morton_encode(ix, iy, iz)
+        nodes[n] = P2F(iNodeP)
+        n += 1
+
+    return keys, nodes
+
+
+def build_neighbors(batsclass):
+    '''Build the table of the 26 face, edge and corner neighbors of each
+    block (leaf), as in BATL's DiLevelNei_IIIB and iNodeNei_IIIB:
+
+    neighbor_dlevel[1+di, 1+dj, 1+dk, iBlockP]: level of the neighbor in
+        direction (di, dj, dk), each -1, 0 or 1, minus the level of block
+        iBlockP; -1 for a coarser neighbor, 1 for finer ones, and Unset_
+        outside of the domain. [1, 1, 1] is the block itself.
+    neighbor_blocks[1+di, 1+dj, 1+dk, :, iBlockP]: block indices of the
+        neighbor in slot 0 (same level or coarser) or of the 4, 2 or 1
+        finer neighbors across a face, edge or corner, in order of x, then
+        y, then z. Unused slots are -1.
+
+    Assumes that levels of neighbors differ by at most one, as BATL does.
+    '''
+
+    nBlock = batsclass.block2node.size
+    swmfio.logger.info(f"Building neighbor table for {nBlock} blocks")
+
+    dlevel = np.full((3, 3, 3, nBlock), Unset_, dtype=np.int8)
+    blocks = np.full((3, 3, 3, 4, nBlock), -1, dtype=np.int32)
+    _fill_neighbors(batsclass, dlevel, blocks)
+
+    batsclass.neighbor_dlevel = dlevel
+    batsclass.neighbor_blocks = blocks
+
+
+@numba.njit(parallel=True)
+def _fill_neighbors(batsclass, dlevel, blocks):
+
+    for iBlockP in numba.prange(batsclass.block2node.size):
+        iNodeP = batsclass.block2node[iBlockP]
+        level = batsclass.block_amr_levels[iNodeP]
+
+        lo = np.array([batsclass.block_x_min[iNodeP], batsclass.block_y_min[iNodeP], batsclass.block_z_min[iNodeP]])
+        hi = np.array([batsclass.block_x_max[iNodeP], batsclass.block_y_max[iNodeP], batsclass.block_z_max[iNodeP]])
+        glo = np.array([batsclass.xGlobalMin, batsclass.yGlobalMin, batsclass.zGlobalMin])
+        ghi = np.array([batsclass.xGlobalMax, batsclass.yGlobalMax, batsclass.zGlobalMax])
+        size = hi - lo
+
+        point = np.empty(3)
+        for di in range(-1, 2):
+            for dj in range(-1, 2):
+                for dk in range(-1, 2):
+                    d = (di, dj, dk)
+                    # Probe at a quarter of the block size beyond each
+                    # crossed face, and at the quarter points along the
+                    # other directions, where finer neighbors would be.
+                    nProbe = 1
+                    for iDim in range(3):
+                        if d[iDim] == 0:
+                            nProbe *= 2
+
+                    n = 0
+                    for iProbe in range(nProbe):
+                        inside = True
+                        bit = 0
+                        for iDim in range(3):
+                            if d[iDim] == -1:
+                                point[iDim] = lo[iDim] - size[iDim]/4
+                            elif d[iDim] == 1:
+                                point[iDim] = hi[iDim] + size[iDim]/4
+                            else:
+                                point[iDim] = lo[iDim] + size[iDim]*(0.25 + 0.5*((iProbe >> bit) & 1))
+                                bit += 1
+                            if not (glo[iDim] <= point[iDim] <= ghi[iDim]):
+                                inside = False
+                        if not inside:
+                            break
+
+                        iNode = batsclass.find_tree_node(point)
+                        iNeighborP = batsclass.node2block[F2P(iNode)]
+                        dlevel[1+di, 1+dj, 1+dk, iBlockP] = batsclass.block_amr_levels[F2P(iNode)] - level
+                        if dlevel[1+di, 1+dj, 1+dk, iBlockP] <= 0:
+                            # The same or a coarser block covers all probes
+                            blocks[1+di, 1+dj, 1+dk, 0, iBlockP] = iNeighborP
+                            break
+                        blocks[1+di, 1+dj, 1+dk, n, iBlockP] = iNeighborP
+                        n += 1
+
+
+def build_halo(batsclass):
+    '''Build a copy of DataArray with one layer of ghost cells around each
+    block, shape (nVar, nI+2, nJ+2, nK+2, nBlock). Interpolation then uses
+    it, so that points in the outer half-cell of a block are interpolated
+    between cells of the block and of its neighbors instead of taking the
+    value of the nearest cell. This takes (nI+2)*(nJ+2)*(nK+2)/(nI*nJ*nK)
+    times the memory of DataArray (3.4 for 4x4x4 blocks, 2 for 8x8x8).
+    As DataArray is a view of data_arr, halo is a view of halo_arr, which
+    has one row per cell.
+
+    Ghost cells are filled from the leaf that contains their center:
+    copied from a neighbor at the same level, averaged over the eight cells
+    of a finer neighbor (restriction), or interpolated in a coarser
+    neighbor (prolongation). Prolongation is done a second time from the
+    halo of the coarser neighbor so that it does not clamp at that block's
+    edge. Ghost cells outside of the domain copy the nearest cell.
+    '''
+
+    DA = batsclass.DataArray
+    nVar, nI, nJ, nK, nBlock = DA.shape
+    swmfio.logger.info(f"Building halo arrays for {nBlock} blocks")
+
+    halo_arr = np.zeros(((nI+2)*(nJ+2)*(nK+2)*nBlock, nVar), dtype=np.float32)
+    halo = _halo_view(halo_arr, nI, nJ, nK)
+    halo[:, 1:nI+1, 1:nJ+1, 1:nK+1, :] = DA
+    _fill_halo(batsclass, DA, halo)
+
+    # Prolongation from the halo of the coarser block. Read from a copy so
+    # that the result does not depend on the order in which blocks are done.
+    _fill_halo(batsclass, halo.copy(order='F'), halo)
+
+    batsclass.halo_arr = halo_arr
+    batsclass.halo = halo
+
+
+def _halo_view(halo_arr, nI, nJ, nK):
+    nBlock = halo_arr.shape[0]//((nI+2)*(nJ+2)*(nK+2))
+    halo = halo_arr.transpose().reshape((halo_arr.shape[1], nI+2, nJ+2, nK+2, nBlock), order='F')
+    assert(np.shares_memory(halo, halo_arr))
+    return halo
+
+
+@numba.njit(parallel=True)
+def _fill_halo(batsclass, src, dst):
+    '''Fill the ghost cells of dst. If src is DataArray (first pass), all
+    ghost cells are filled and prolongation clamps at block edges;
+    otherwise src is the halo from the first pass and only ghost cells with
+    a coarser neighbor are recomputed.'''
+
+    _x = batsclass.varidx['x']
+    _y = batsclass.varidx['y']
+    _z = batsclass.varidx['z']
+
+    DA = batsclass.DataArray
+    nVar, nI, nJ, nK, nBlock = DA.shape
+    first_pass = src.shape[1] == nI
+
+    for iBlockP in numba.prange(nBlock):
+        level = batsclass.block_amr_levels[batsclass.block2node[iBlockP]]
+
+        dx = DA[_x,1,0,0,iBlockP] - DA[_x,0,0,0,iBlockP]
+        dy = DA[_y,0,1,0,iBlockP] - DA[_y,0,0,0,iBlockP]
+        dz = DA[_z,0,0,1,iBlockP] - DA[_z,0,0,0,iBlockP]
+
+        point = np.empty(3)
+        sub = np.empty(3)
+        for k in range(-1, nK+1):
+            for j in range(-1, nJ+1):
+                for i in range(-1, nI+1):
+                    if 0 <= i < nI and 0 <= j < nJ and 0 <= k < nK:
+                        continue
+
+                    point[0] = DA[_x,0,0,0,iBlockP] + i*dx
+                    point[1] = DA[_y,0,0,0,iBlockP] + j*dy
+                    point[2] = DA[_z,0,0,0,iBlockP] + k*dz
+
+                    xin = batsclass.xGlobalMin <= point[0] <= batsclass.xGlobalMax
+                    yin = batsclass.yGlobalMin <= point[1] <= batsclass.yGlobalMax
+                    zin = batsclass.zGlobalMin <= point[2] <= batsclass.zGlobalMax
+                    if not (xin and yin and zin):
+                        if first_pass:
+                            ic = min(max(i, 0), nI-1)
+                            jc = min(max(j, 0), nJ-1)
+                            kc = min(max(k, 0), nK-1)
+                            for iVar in range(nVar):
+                                dst[iVar,i+1,j+1,k+1,iBlockP] = DA[iVar,ic,jc,kc,iBlockP]
+                        continue
+
+                    iNode = batsclass.find_tree_node(point)
+                    iNeighborP = batsclass.node2block[F2P(iNode)]
+                    neighbor_level = batsclass.block_amr_levels[F2P(iNode)]
+
+                    if neighbor_level < level:
+                        # Prolongation
+                        if first_pass:
+                            i0, i1, j0, j1, k0, k1, xd, yd, zd = _trilinear_stencil(DA, _x, _y, _z, iNeighborP, point)
+                        else:
+                            i0, i1, j0, j1, k0, k1, xd, yd, zd = _halo_stencil(DA, _x, _y, _z, iNeighborP, point)
+                        for iVar in range(nVar):
+                            dst[iVar,i+1,j+1,k+1,iBlockP] = _trilinear(src, iVar, iNeighborP, i0, i1, j0, j1, k0, k1, xd, yd, zd)
+                    elif not first_pass:
+                        continue
+                    elif neighbor_level == level:
+                        i0, i1, j0, j1, k0, k1, xd, yd, zd = _trilinear_stencil(DA, _x, _y, _z, iNeighborP, point)
+                        for iVar in range(nVar):
+                            dst[iVar,i+1,j+1,k+1,iBlockP] = _trilinear(DA, iVar, iNeighborP, i0, i1, j0, j1, k0, k1, xd, yd, zd)
+                    else:
+                        # Restriction: average of the values at the centers
+                        # of the eight finer cells in the ghost cell
+                        for iVar in range(nVar):
+                            dst[iVar,i+1,j+1,k+1,iBlockP] = 0.
+                        for c in range(8):
+                            sub[0] = point[0] + (c % 2 - 0.5)*dx/2
+                            sub[1] = point[1] + ((c//2) % 2 - 0.5)*dy/2
+                            sub[2] = point[2] + (c//4 - 0.5)*dz/2
+                            iFineP = batsclass.node2block[F2P(batsclass.find_tree_node(sub))]
+                            i0, i1, j0, j1, k0, k1, xd, yd, zd = _trilinear_stencil(DA, _x, _y, _z, iFineP, sub)
+                            for iVar in range(nVar):
+                                dst[iVar,i+1,j+1,k+1,iBlockP] += _trilinear(DA, iVar, iFineP, i0, i1, j0, j1, k0, k1, xd, yd, zd)/8
+
+
+def remap_conservative(batsclass, variables, shape, bounds=None):
+    '''Conservative remapping of variables (a tuple of names) onto a
+    uniform grid of shape (nx, ny, nz) that spans bounds, ((xmin, xmax),
+    (ymin, ymax), (zmin, zmax)); the simulation domain by default.
+
+    Each native cell contributes its value times its overlap volume with
+    each grid cell, so grid cells may be finer or coarser than the native
+    cells. Returns the values, shape (nvars, nx, ny, nz), which are averages
+    over the part of each grid cell that is in the domain (NaN if none
+    is), and the volume of that part, shape (nx, ny, nz). The integral of
+    a variable over the domain, sum(values[v]*volume), equals the sum
+    over native cells of value times measure.
+
+    Work is split over z-slabs of the grid, so that each thread adds only
+    to its own slab; the cost is proportional to the number of native and
+    grid cell pairs that overlap.
+    '''
+
+    if bounds is None:
+        bounds = ((batsclass.xGlobalMin, batsclass.xGlobalMax),
+                  (batsclass.yGlobalMin, batsclass.yGlobalMax),
+                  (batsclass.zGlobalMin, batsclass.zGlobalMax))
+    lo = np.array([b[0] for b in bounds], dtype=np.float64)
+    hi = np.array([b[1] for b in bounds], dtype=np.float64)
+    shape = np.array(shape, dtype=np.int64)
+
+    iVars = _var_indices(batsclass.varidx, tuple(variables))
+
+    sums = np.zeros((iVars.size, shape[0], shape[1], shape[2]), dtype=np.float64)
+    volume = np.zeros((shape[0], shape[1], shape[2]), dtype=np.float64)
+    _remap_conservative(batsclass, iVars, lo, (hi - lo)/shape, sums, volume)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = np.where(volume > 0, sums/volume, np.nan)
+
+    return values, volume
+
+
+@numba.njit
+def _overlap_range(a, b, lo, h, n):
+    '''Range of grid cells (edges lo + m*h, m = 0..n) that overlap [a, b].'''
+    m0 = max(int(np.floor((a - lo)/h)), 0)
+    m1 = min(int(np.ceil((b - lo)/h)), n)
+    return m0, m1
+
+
+@numba.njit
+def _overlap(a, b, lo, h, m):
+    return max(min(b, lo + (m + 1)*h) - max(a, lo + m*h), 0.)
+
+
+@numba.njit(parallel=True)
+def _remap_conservative(batsclass, iVars, lo, h, sums, volume):
+
+    _x = batsclass.varidx['x']
+    _y = batsclass.varidx['y']
+    _z = batsclass.varidx['z']
+
+    DA = batsclass.DataArray
+    nVar, nI, nJ, nK, nBlock = DA.shape
+    nx, ny, nz = volume.shape
+
+    for mz in numba.prange(nz):
+        zlo = lo[2] + mz*h[2]
+        zhi = zlo + h[2]
+        for iBlockP in range(nBlock):
+            dx, dy, dz = _grid_spacing(DA, _x, _y, _z, iBlockP)
+            z0 = DA[_z,0,0,0,iBlockP] - dz/2
+            if z0 >= zhi or z0 + nK*dz <= zlo:
+                continue
+            x0 = DA[_x,0,0,0,iBlockP] - dx/2
+            y0 = DA[_y,0,0,0,iBlockP] - dy/2
+            for k in range(nK):
+                wz = _overlap(z0 + k*dz, z0 + (k+1)*dz, lo[2], h[2], mz)
+                if wz == 0.:
+                    continue
+                for j in range(nJ):
+                    my0, my1 = _overlap_range(y0 + j*dy, y0 + (j+1)*dy, lo[1], h[1], ny)
+                    for i in range(nI):
+                        mx0, mx1 = _overlap_range(x0 + i*dx, x0 + (i+1)*dx, lo[0], h[0], nx)
+                        for my in range(my0, my1):
+                            wy = _overlap(y0 + j*dy, y0 + (j+1)*dy, lo[1], h[1], my)
+                            for mx in range(mx0, mx1):
+                                w = _overlap(x0 + i*dx, x0 + (i+1)*dx, lo[0], h[0], mx)*wy*wz
+                                if w == 0.:
+                                    continue
+                                volume[mx, my, mz] += w
+                                for v in range(iVars.size):
+                                    sums[v, mx, my, mz] += w*DA[iVars[v], i, j, k, iBlockP]
+
+
+def _phase(stats, name, nbytes=0):
+    if stats is None:
+        return contextlib.nullcontext()
+    return stats.phase(name, nbytes=nbytes)
+
+
+def _compile_class():
+    '''Compile BatsrusClass.__init__ for the argument types used by
+    get_class_from_native() by constructing a one-block instance that skips
+    the tree search, so that compile time can be timed on its own.'''
+
+    varidx = numba.typed.Dict.empty(key_type=numba.types.unicode_type, value_type=numba.types.int32)
+    i32 = np.zeros(1, dtype=np.int32)
+    f32 = np.zeros(1, dtype=np.float32)
+    data_arr = np.zeros((8, 2), dtype=np.float32)
+    BatsrusClass(3, 2, 2, 2, 0., 0., 0., 1., 1., 1.,
+                 i32, i32, np.zeros((8, 1), dtype=np.int32), i32,
+                 f32, f32, f32, f32, f32, f32, np.zeros(1, dtype=np.int8),
+                 data_arr, data_arr.transpose().reshape((2, 2, 2, 2, 1), order='F'), varidx,
+                 i32, i32, '')
+
+
+def get_class_from_native(file, stats=None):
+
+    with _phase(stats, 'tree read', os.path.getsize(file + '.tree') + os.path.getsize(file + '.info')):
+        iTree_IA, iRatio_D, nRoot_D, info = read_tree(file)
+    with _phase(stats, 'data read', os.path.getsize(file + '.out')):
+        data_arr, variables, meta = read_data(file)
     nI = int(info['BlockSize1'])
     nJ = int(info['BlockSize2'])
     nK = int(info['BlockSize3'])
@@ -407,29 +1906,30 @@ def get_class_from_native(file):
     nBlock = npts//(nI*nJ*nK) if npts%(nI*nJ*nK)==0 else -1
 
     swmfio.logger.info(f"Preparing DataArray")
-
-    assert(not np.isfortran(data_arr))
-    DataArray = data_arr.transpose()
-    assert(np.isfortran(DataArray))
-
-    # +1 for added variable 'measure' (volume)
-    DataArray = DataArray.reshape((len(variables)+1, nI, nJ, nK, nBlock), order='F')
-    assert(np.isfortran(DataArray))
+    with _phase(stats, 'DataArray reshaping'):
+        assert(not np.isfortran(data_arr))
+        DataArray = data_arr.transpose()
+        assert(np.isfortran(DataArray))
+
+        # +1 for added variable 'measure' (volume)
+        DataArray = DataArray.reshape((len(variables)+1, nI, nJ, nK, nBlock), order='F')
+        assert(np.isfortran(DataArray))
     swmfio.logger.info(f"Prepared DataArray")
 
     swmfio.logger.info(f"Creating numba varidx Dict")
-    # This is very slow.
-    # https://github.com/numba/numba/issues/3644
-    varidx = numba.typed.Dict.empty(
-                    key_type=numba.types.unicode_type,
-                    value_type=numba.types.int32,
-        )
+    with _phase(stats, 'varidx creation'):
+        # This is very slow.
+        # https://github.com/numba/numba/issues/3644
+        varidx = numba.typed.Dict.empty(
+                        key_type=numba.types.unicode_type,
+                        value_type=numba.types.int32,
+            )
+
+        varidx['measure'] = np.int32(len(variables))
+        for ivar, var in enumerate(variables):
+            varidx[var] = np.int32(ivar)
     swmfio.logger.info(f"Created numba varidx Dict")
 
-    varidx['measure'] = np.int32(len(variables))
-    for ivar, var in enumerate(variables):
-        varidx[var] = np.int32(ivar)
-
     # In what follows, the P in iNodeP and iBlockP stands for Python-like
     # indexing (as opposed to Fortran)
     #
@@ -467,94 +1967,103 @@ def get_class_from_native(file):
         return PositionMin_D, PositionMax_D
 
 
-    block_parent_id = iTree_IA[Parent_, :].copy()
+    block_parent_id = iTree_IA[F2P(Parent_), :].copy()
     block_child_ids = iTree_IA[F2P(Child1_):F2P(Child1_)+8, :].copy()
     block_amr_levels = iTree_IA[F2P(Level_), :].copy()
 
     amr_level_0_nodes = np.array(P2F(np.where(block_amr_levels == 0)[0]), dtype='int32')
 
-    swmfio.logger.info(f"Creating min/max arrays")
-    # initialize arrays to -1 (invalid index), will be computed in __init__
-    block2node = -np.ones((nBlock,), dtype=np.int32)
-    node2block = -np.ones((nNode,), dtype=np.int32)
-
-    block_x_min = np.empty(nNode, dtype=np.float32)
-    block_y_min = np.empty(nNode, dtype=np.float32)
-    block_z_min = np.empty(nNode, dtype=np.float32)
-    block_x_max = np.empty(nNode, dtype=np.float32)
-    block_y_max = np.empty(nNode, dtype=np.float32)
-    block_z_max = np.empty(nNode, dtype=np.float32)
-    block_child_count = np.empty(nNode, dtype=np.int8)
-    swmfio.logger.info(f"Created min/max arrays")
-
-    swmfio.logger.info(f"Populating min/max arrays")
-    for iNodeP in range(nNode):
-        if   iTree_IA[F2P(Status_), iNodeP] == Used_:
-            block_child_count[iNodeP] = 0
-        elif iTree_IA[F2P(Status_), iNodeP] == Unused_:
-            block_child_count[iNodeP] = 8
-        else:
-            assert(False)
-
-        x_start = xGlobalMin
-        y_start = yGlobalMin
-        z_start = zGlobalMin
-        x_range = xGlobalMax - xGlobalMin
-        y_range = yGlobalMax - yGlobalMin
-        z_range = zGlobalMax - zGlobalMin
-
-        iLevel = iTree_IA[F2P(Level_), iNodeP]
-        assert(nI == nJ == nK)
-        assert(x_range == y_range == z_range)
-        gridspacing = (x_range/nI)*0.5**iLevel
-
-        PositionMin_D, PositionMax_D = get_tree_position(P2F(iNodeP))
-        block_x_min[iNodeP] = x_range*(PositionMin_D[0]) + x_start
-        block_y_min[iNodeP] = y_range*(PositionMin_D[1]) + y_start
-        block_z_min[iNodeP] = z_range*(PositionMin_D[2]) + z_start
-        block_x_max[iNodeP] = x_range*(PositionMax_D[0]) + x_start
-        block_y_max[iNodeP] = y_range*(PositionMax_D[1]) + y_start
-        block_z_max[iNodeP] = z_range*(PositionMax_D[2]) + z_start
-
-    swmfio.logger.info(f"Populated min/max arrays")
-
-    batsclass = BatsrusClass(
-                      nDim              = 3         ,
-                      nI                = nI        ,
-                      nJ                = nJ        ,
-                      nK                = nK        ,
-                      xGlobalMin        = xGlobalMin,
-                      yGlobalMin        = yGlobalMin,
-                      zGlobalMin        = zGlobalMin,
-                      xGlobalMax        = xGlobalMax,
-                      yGlobalMax        = yGlobalMax,
-                      zGlobalMax        = zGlobalMax,
-
-                      amr_level_0_nodes = amr_level_0_nodes,
-                      block_parent_id   = block_parent_id   ,
-                      block_child_ids   = block_child_ids   ,
-                      block_amr_levels  = block_amr_levels  ,
-                      block_x_min       = block_x_min       ,
-                      block_y_min       = block_y_min       ,
-                      block_z_min       = block_z_min       ,
-                      block_x_max       = block_x_max       ,
-                      block_y_max       = block_y_max       ,
-                      block_z_max       = block_z_max       ,
-                      block_child_count = block_child_count ,
-
-                      data_arr          = data_arr     ,
-                      DataArray         = DataArray    ,
-                      varidx            = varidx       ,
-
-                      block2node        = block2node   ,
-                      node2block        = node2block   ,
-                      file              = file
-                )
+    with _phase(stats, 'bounds arrays'):
+        swmfio.logger.info(f"Creating min/max arrays")
+        # initialize arrays to -1 (invalid index), will be computed in __init__
+        block2node = -np.ones((nBlock,), dtype=np.int32)
+        node2block = -np.ones((nNode,), dtype=np.int32)
+
+        block_x_min = np.empty(nNode, dtype=np.float32)
+        block_y_min = np.empty(nNode, dtype=np.float32)
+        block_z_min = np.empty(nNode, dtype=np.float32)
+        block_x_max = np.empty(nNode, dtype=np.float32)
+        block_y_max = np.empty(nNode, dtype=np.float32)
+        block_z_max = np.empty(nNode, dtype=np.float32)
+        block_child_count = np.empty(nNode, dtype=np.int8)
+        swmfio.logger.info(f"Created min/max arrays")
+
+        swmfio.logger.info(f"Populating min/max arrays")
+        for iNodeP in range(nNode):
+            if   iTree_IA[F2P(Status_), iNodeP] == Used_:
+                block_child_count[iNodeP] = 0
+            elif iTree_IA[F2P(Status_), iNodeP] == Unused_:
+                block_child_count[iNodeP] = 8
+            else:
+                assert(False)
+
+            x_start = xGlobalMin
+            y_start = yGlobalMin
+            z_start = zGlobalMin
+            x_range = xGlobalMax - xGlobalMin
+            y_range = yGlobalMax - yGlobalMin
+            z_range = zGlobalMax - zGlobalMin
+
+            iLevel = iTree_IA[F2P(Level_), iNodeP]
+            assert(nI == nJ == nK)
+            assert(x_range == y_range == z_range)
+            gridspacing = (x_range/nI)*0.5**iLevel
+
+            PositionMin_D, PositionMax_D = get_tree_position(P2F(iNodeP))
+            block_x_min[iNodeP] = x_range*(PositionMin_D[0]) + x_start
+            block_y_min[iNodeP] = y_range*(PositionMin_D[1]) + y_start
+            block_z_min[iNodeP] = z_range*(PositionMin_D[2]) + z_start
+            block_x_max[iNodeP] = x_range*(PositionMax_D[0]) + x_start
+            block_y_max[iNodeP] = y_range*(PositionMax_D[1]) + y_start
+            block_z_max[iNodeP] = z_range*(PositionMax_D[2]) + z_start
+
+        swmfio.logger.info(f"Populated min/max arrays")
+
+    if stats is not None:
+        with _phase(stats, 'numba compile'):
+            _compile_class()
+
+    with _phase(stats, 'block2node construction'):
+        batsclass = BatsrusClass(
+                          nDim              = 3         ,
+                          nI                = nI        ,
+                          nJ                = nJ        ,
+                          nK                = nK        ,
+                          xGlobalMin        = xGlobalMin,
+                          yGlobalMin        = yGlobalMin,
+                          zGlobalMin        = zGlobalMin,
+                          xGlobalMax        = xGlobalMax,
+                          yGlobalMax        = yGlobalMax,
+                          zGlobalMax        = zGlobalMax,
+
+                          amr_level_0_nodes = amr_level_0_nodes,
+                          block_parent_id   = block_parent_id   ,
+                          block_child_ids   = block_child_ids   ,
+                          block_amr_levels  = block_amr_levels  ,
+                          block_x_min       = block_x_min       ,
+                          block_y_min       = block_y_min       ,
+                          block_z_min       = block_z_min       ,
+                          block_x_max       = block_x_max       ,
+                          block_y_max       = block_y_max       ,
+                          block_z_max       = block_z_max       ,
+                          block_child_count = block_child_count ,
+
+                          data_arr          = data_arr     ,
+                          DataArray         = DataArray    ,
+                          varidx            = varidx       ,
+
+                          block2node        = block2node   ,
+                          node2block        = node2block   ,
+                          file              = file
+                    )
+
+    if 'rbody' in meta['Scalars']:
+        batsclass.rBody = float(meta['ScalarValues'][meta['Scalars'].index('rbody')])
 
     return batsclass
 
 
-def get_class_from_cdf(file):
+def get_class_from_cdf(file, stats=None):
 
     import cdflib.cdfread as cdfread
 
@@ -592,19 +2101,20 @@ def get_class_from_cdf(file):
     data_arr = np.empty((npts, nVar), dtype=np.float32);
     data_arr[:,:] = np.nan
 
-    iVar = 0
-    for cdfvar in cdf.cdf_info()['zVariables']:
-        try:
-            var = cdf.varattsget(cdfvar)['Original Name']
-        except:
-            var = cdfvar
-
-        if cdf.varget(cdfvar).shape == (1, npts):
-            #swmfio.logger.info(f"Reading = {cdfvar}")
-            data_arr[:, iVar] = cdf.varget(cdfvar)[0,:]
-            units[var] = cdf.varattsget(cdfvar)['units']
-            varidx[var] = iVar
-            iVar += 1
+    with _phase(stats, 'data read', os.path.getsize(file)):
+        iVar = 0
+        for cdfvar in cdf.cdf_info()['zVariables']:
+            try:
+                var = cdf.varattsget(cdfvar)['Original Name']
+            except:
+                var = cdfvar
+
+            if cdf.varget(cdfvar).shape == (1, npts):
+                #swmfio.logger.info(f"Reading = {cdfvar}")
+                data_arr[:, iVar] = cdf.varget(cdfvar)[0,:]
+                units[var] = cdf.varattsget(cdfvar)['units']
+                varidx[var] = iVar
+                iVar += 1
 
     swmfio.logger.info("varidx = {}".format(varidx))
 
@@ -612,11 +2122,12 @@ def get_class_from_cdf(file):
 
     assert(not np.isfortran(data_arr))
 
-    DataArray = data_arr.transpose()
-    assert(np.isfortran(DataArray))
+    with _phase(stats, 'DataArray reshaping'):
+        DataArray = data_arr.transpose()
+        assert(np.isfortran(DataArray))
 
-    DataArray = DataArray.reshape((nVar, nI, nJ, nK, nBlock), order='F')
-    assert(np.isfortran(DataArray))
+        DataArray = DataArray.reshape((nVar, nI, nJ, nK, nBlock), order='F')
+        assert(np.isfortran(DataArray))
 
     block_child_ids = np.array([
                                     cdf.varget('block_child_id_1')[0,:],
@@ -633,37 +2144,38 @@ def get_class_from_cdf(file):
     amr_level_0_nodes = P2F( cdf.varget('block_at_amr_level')[0,:] )
     amr_level_0_nodes = np.array(amr_level_0_nodes, dtype=np.int32)
 
-    batsclass = BatsrusClass(
-                      nDim              = globatts['grid_system_1_number_of_dimensions'],
-                      nI                = nI,
-                      nJ                = nJ,
-                      nK                = nK,
-                      xGlobalMin        = globatts['global_x_min'],
-                      yGlobalMin        = globatts['global_y_min'],
-                      zGlobalMin        = globatts['global_z_min'],
-                      xGlobalMax        = globatts['global_x_max'],
-                      yGlobalMax        = globatts['global_y_max'],
-                      zGlobalMax        = globatts['global_z_max'],
-
-                      amr_level_0_nodes         = amr_level_0_nodes,
-                      block_parent_id   = cdf.varget('block_parent_id')[0,:],
-                      block_child_ids   = block_child_ids,
-                      block_amr_levels  = np.array(cdf.varget('block_amr_levels')[0,:], dtype=np.int32),
-                      block_x_min       = cdf.varget('block_x_min')[0,:],
-                      block_y_min       = cdf.varget('block_y_min')[0,:],
-                      block_z_min       = cdf.varget('block_z_min')[0,:],
-                      block_x_max       = cdf.varget('block_x_max')[0,:],
-                      block_y_max       = cdf.varget('block_y_max')[0,:],
-                      block_z_max       = cdf.varget('block_z_max')[0,:],
-                      block_child_count = np.array(cdf.varget('block_child_count')[0,:], dtype=np.int8),
-
-                      data_arr          = data_arr     ,
-                      DataArray         = DataArray    ,
-                      varidx            = varidx       ,
-
-                      block2node        = block2node   ,
-                      node2block        = node2block   ,
-                      file              = file
-                )
+    with _phase(stats, 'block2node construction'):
+        batsclass = BatsrusClass(
+                          nDim              = globatts['grid_system_1_number_of_dimensions'],
+                          nI                = nI,
+                          nJ                = nJ,
+                          nK                = nK,
+                          xGlobalMin        = globatts['global_x_min'],
+                          yGlobalMin        = globatts['global_y_min'],
+                          zGlobalMin        = globatts['global_z_min'],
+                          xGlobalMax        = globatts['global_x_max'],
+                          yGlobalMax        = globatts['global_y_max'],
+                          zGlobalMax        = globatts['global_z_max'],
+
+                          amr_level_0_nodes         = amr_level_0_nodes,
+                          block_parent_id   = np.array(P2F(cdf.varget('block_parent_id')[0,:]), dtype=np.int32),
+                          block_child_ids   = block_child_ids,
+                          block_amr_levels  = np.array(cdf.varget('block_amr_levels')[0,:], dtype=np.int32),
+                          block_x_min       = cdf.varget('block_x_min')[0,:],
+                          block_y_min       = cdf.varget('block_y_min')[0,:],
+                          block_z_min       = cdf.varget('block_z_min')[0,:],
+                          block_x_max       = cdf.varget('block_x_max')[0,:],
+                          block_y_max       = cdf.varget('block_y_max')[0,:],
+                          block_z_max       = cdf.varget('block_z_max')[0,:],
+                          block_child_count = np.array(cdf.varget('block_child_count')[0,:], dtype=np.int8),
+
+                          data_arr          = data_arr     ,
+                          DataArray         = DataArray    ,
+                          varidx            = varidx       ,
+
+                          block2node        = block2node   ,
+                          node2block        = node2block   ,
+                          file              = file
+                    )
 
     return batsclass
@@ -7,43 +7,489 @@ Created on Sat Mar 23 07:21:06 2024
 """
 
 import logging
+import hashlib
+import threading
+import weakref
+import multiprocessing
+import numba
 import numpy as np
 from copy import deepcopy
 
-from swmfio.OCTREE_BLOCK_GRID._interpolate_amrdata import ffi
-from swmfio.OCTREE_BLOCK_GRID._interpolate_amrdata import lib
+import swmfio
+from swmfio.batsrus_class import F2P, P2F, PointOk_, _node_contains, _point_status, _var_indices
+
+# The CCMC OCTREE library is built by hand (see README-Interpolator.txt).
+# Without it, only engine='numba' is available.
+try:
+    from swmfio.OCTREE_BLOCK_GRID import _interpolate_amrdata
+    from swmfio.OCTREE_BLOCK_GRID._interpolate_amrdata import ffi
+    from swmfio.OCTREE_BLOCK_GRID._interpolate_amrdata import lib
+    # Lets numba compiled code call the library (_interpolate_octree())
+    from numba.core.typing import cffi_utils
+    cffi_utils.register_module(_interpolate_amrdata)
+except ImportError:
+    ffi = None
+    lib = None
+
+# Octrees built by setup_octree(), keyed by grid_fingerprint(), so that
+# snapshots on the same grid (e.g., consecutive outputs of a run without AMR
+# changes) share one. At most _octree_cache_size are kept; see
+# clear_octree_cache().
+_octree_cache = {}
+_octree_cache_size = 4
+
+# The library is not reentrant: it keeps pointers to one octree in global
+# variables, set by lib.setup_octree_pointers(), and interpolate_amrdata()
+# keeps the cell stencil of the last point in static variables. So at most
+# one thread may use it at a time. _octree_lock serializes the calls;
+# _octree_current is the octree the library is set up for.
+_octree_lock = threading.RLock()
+_octree_current = [None]
+
+# MAX_AMRLEVEL of the first octree set up. The library allocates its table
+# of blocks per level once, for that number of levels.
+_octree_max_amrlevel = [None]
+
+
+def grid_fingerprint(batsrus):
+    '''Key that is equal for two BatsrusClass instances with the same cell
+    centers in the same order.'''
+    h = hashlib.sha1()
+    for var in ('x', 'y', 'z'):
+        h.update(np.ascontiguousarray(batsrus.data_arr[:, batsrus.varidx[var]]).data)
+    return (batsrus.nI, batsrus.nJ, batsrus.nK, batsrus.data_arr.shape[0], h.hexdigest())
+
+
+def clear_octree_cache():
+    '''Release the octrees kept for reuse by new interpolators. Existing
+    interpolators keep theirs.'''
+    with _octree_lock:
+        _octree_cache.clear()
+        _octree_current[0] = None
+
+
+def _xyz_ranges(octree):
+    '''Run lib.xyz_ranges() on the cell centers of octree; fills its block
+    ranges and box_range. Returns the number of blocks, negative if the
+    block shape could not be determined.'''
+
+    N_blks = lib.xyz_ranges(octree['Ncell'], ffi.from_buffer("float[]", octree['x']),
+                            ffi.from_buffer("float[]", octree['y']),
+                            ffi.from_buffer("float[]", octree['z']),
+                            octree['xr_blk'], octree['yr_blk'], octree['zr_blk'],
+                            octree['x_blk'], octree['y_blk'], octree['z_blk'],
+                            octree['box_range'],
+                            octree['NX'], octree['NY'], octree['NZ'], 1)
+    if N_blks <= 0:
+        return N_blks
+
+    # xyz_ranges() only raises the upper end of the box to the end of a
+    # block whose lower end is above it, so with blocks in order of
+    # position the box can end at the first block. Take both ends from the
+    # block ranges.
+    for iDim, name in enumerate(('xr_blk', 'yr_blk', 'zr_blk')):
+        ranges = np.frombuffer(ffi.buffer(octree[name]), dtype=np.float32)[0:2*N_blks]
+        octree['box_range'][2*iDim] = float(ranges[0::2].min())
+        octree['box_range'][2*iDim+1] = float(ranges[1::2].max())
+
+    return N_blks
+
+
+def _setup_octree(octree):
+    '''Build the tree of octree in the library and point the library at it.
+    Call with _octree_lock held.'''
+
+    if _octree_max_amrlevel[0] is None:
+        _octree_max_amrlevel[0] = octree['MAX_AMRLEVEL']
+    elif octree['MAX_AMRLEVEL'] > _octree_max_amrlevel[0]:
+        raise RuntimeError(f"The OCTREE library was set up for {_octree_max_amrlevel[0]} AMR "
+                           f"levels and cannot take a grid with {octree['MAX_AMRLEVEL']}; "
+                           "use a new process or engine='numba'.")
+
+    status = lib.setup_octree(octree['N_blks'][0],
+                              octree['xr_blk'], octree['yr_blk'], octree['zr_blk'],
+                              octree['MAX_AMRLEVEL'], octree['box_range'],
+                              octree['octree_blocklist'], octree['N_octree'],
+                              octree['numparents_at_AMRlevel'], octree['block_at_AMRlevel'])
+    lib.setup_octree_pointers(octree['MAX_AMRLEVEL'],
+                              octree['octree_blocklist'],
+                              octree['numparents_at_AMRlevel'],
+                              octree['block_at_AMRlevel'])
+
+    # setup_octree() returns -1 on failure, but the cffi declaration in
+    # the CCMC build script has it return void (status None). Also check
+    # that the tree locates the center of each block.
+    N_blks = octree['N_blks'][0]
+    ranges = [np.frombuffer(ffi.buffer(octree[name]), dtype=np.float32)[0:2*N_blks]
+                for name in ('xr_blk', 'yr_blk', 'zr_blk')]
+    if status not in (None, 0) or _misplaced_blocks(*ranges) > 0:
+        _octree_current[0] = None
+        raise RuntimeError(f"The OCTREE library could not build the octree (status {status}).")
+    _octree_current[0] = octree
+
+
+def _use_octree(octree):
+    '''Set the library up for octree. Besides the pointers that
+    lib.setup_octree_pointers() sets, xyz_ranges() and setup_octree() set
+    global variables (block shape, number of blocks, block centers), so
+    when the library was last used with another octree, both are run again
+    on the arrays of octree, which gives the same results as when it was
+    built. Call with _octree_lock held.'''
+    if _octree_current[0] is not octree:
+        _xyz_ranges(octree)
+        _setup_octree(octree)
+
+
+@numba.njit
+def _misplaced_blocks(xr, yr, zr):
+    '''Number of blocks, with ranges xr, yr, zr as from xyz_ranges(), whose
+    center the library does not locate in the block itself.'''
+    n = 0
+    for ib in range(xr.size//2):
+        iFound = lib.find_octree_block(0.5*(xr[2*ib] + xr[2*ib+1]), 0.5*(yr[2*ib] + yr[2*ib+1]),
+                                       0.5*(zr[2*ib] + zr[2*ib+1]), -1, -1)
+        if iFound != ib:
+            n += 1
+    return n
+
+
+@numba.njit
+def _interpolate_octree(X, Y, Z, fields, box, out):
+    '''Interpolate each of fields (a tuple of cell arrays) at the points
+    X, Y, Z into out[v, :] with the library. The first variable locates
+    each point; the others reuse the cell stencil that the library keeps
+    from it (new_position = 0).
+
+    Returns the number of points inside box (xmin, xmax, ymin, ymax, zmin,
+    zmax) for which the library returned its missing value (NaN).'''
+    failed = 0
+    for n in range(X.size):
+        for v in range(len(fields)):
+            out[v, n] = lib.interpolate_amrdata(X[n], Y[n], Z[n], ffi.from_buffer(fields[v]), 1 if v == 0 else 0)
+        if (np.isnan(out[0, n]) and box[0] <= X[n] <= box[1] and box[2] <= Y[n] <= box[3]
+                and box[4] <= Z[n] <= box[5]):
+            failed += 1
+    return failed
+
+
+# engine='octree' with nthreads > 1: each worker process has its own copy of
+# the library's global variables, so it can set up its own octree. Workers
+# attach the snapshot exported by the parent (swmfio.export_shared()) and
+# build their interpolator once, in _octree_worker_init().
+_octree_worker = [None]
+
+def _octree_worker_init(handle, varnames):
+    binterp = batsrus_interpolator(handle.attach())
+    for name in varnames:
+        binterp.register_variable(name)
+    _octree_worker[0] = binterp
+
+def _octree_worker_interp(X, Y, Z, varnames):
+    binterp = _octree_worker[0]
+    for name in varnames:
+        if name not in binterp.var_data:
+            binterp.register_variable(name)
+    return binterp._interp_octree(X, Y, Z, varnames)
+
+def _close_octree_pool(pool, handle):
+    pool.terminate()
+    pool.join()
+    handle.unlink()
+
+
+# engine='numba': interpolate_amrdata() of the library, reimplemented on the
+# arrays of a BatsrusClass. Block indices are those of DataArray, as the
+# library's are those of the cell arrays passed to it.
+
+@numba.njit
+def _ccmc_block(batsclass, probe, last):
+    '''Block (index in DataArray) that contains probe, or -1 if it is outside
+    of the domain. Block last (if not -1) is tried first: the corners of a
+    stencil that are outside of the block of the point are mostly in the
+    same neighbor.'''
+    if last >= 0 and _node_contains(batsclass, P2F(batsclass.block2node[last]), probe):
+        return last
+    if _point_status(batsclass, probe, 0.) != PointOk_:
+        return -1
+    return batsclass.node2block[F2P(batsclass.find_tree_node(probe))]
+
+@numba.njit
+def _ccmc_scratch():
+    '''Work arrays for _ccmc_point(): the probe position and, for the eight
+    corners of the stencil, the cell (i, j, k, block), its position and
+    whether it is valid, and the values, positions and validity of the
+    pair-wise averages.'''
+    return (np.empty(3, dtype=np.float64),
+            np.empty((8, 4), dtype=np.int64),
+            np.empty((8, 3), dtype=np.float64),
+            np.empty(8, dtype=np.bool_),
+            np.empty(8, dtype=np.float64),
+            np.empty(8, dtype=np.bool_),
+            np.empty(4, dtype=np.float64),
+            np.empty(4, dtype=np.float64))
+
+@numba.njit
+def _ccmc_point(batsclass, DA, _x, _y, _z, x, y, z, iVars, out, scratch):
+    '''Interpolate variables iVars at (x, y, z) into out as
+    interpolate_amrdata() does. Corners of the cell stencil that are outside
+    of the block of the point are taken from the block that contains the
+    cell center beyond the block edge, snapped to a cell of that block at
+    the position of the point (so at that block's resolution). Values are
+    then averaged pair-wise in x, y and z, weighted by the distance of
+    the point to the positions of the corners. Corners outside of the
+    domain are not used.'''
+
+    nVar, nI, nJ, nK, nBlock = DA.shape
+    probe, cell, pos, valid, data, ok, ys, zs = scratch
+
+    probe[0] = x
+    probe[1] = y
+    probe[2] = z
+    ib = _ccmc_block(batsclass, probe, -1)
+    if ib < 0:
+        out[:] = np.nan
+        return
+
+    x0 = np.float64(DA[_x, 0, 0, 0, ib])
+    y0 = np.float64(DA[_y, 0, 0, 0, ib])
+    z0 = np.float64(DA[_z, 0, 0, 0, ib])
+    dx = DA[_x, 1, 0, 0, ib] - x0
+    dy = DA[_y, 0, 1, 0, ib] - y0
+    dz = DA[_z, 0, 0, 1, ib] - z0
+
+    ixx = int(np.floor((x - x0)/dx))
+    iyy = int(np.floor((y - y0)/dy))
+    izz = int(np.floor((z - z0)/dz))
+
+    # Corner ic is at offsets (ic % 2, (ic//2) % 2, ic//4) in i, j, k
+    last = -1
+    for ic in range(8):
+        i = ixx + ic % 2
+        j = iyy + (ic//2) % 2
+        k = izz + ic//4
+        new_block = False
+        if i < 0:
+            new_block = True
+            probe[0] = x0 - dx
+        elif i > nI-1:
+            new_block = True
+            probe[0] = x0 + nI*dx
+        else:
+            probe[0] = DA[_x, i, 0, 0, ib]
+        if j < 0:
+            new_block = True
+            probe[1] = y0 - dy
+        elif j > nJ-1:
+            new_block = True
+            probe[1] = y0 + nJ*dy
+        else:
+            probe[1] = DA[_y, 0, j, 0, ib]
+        if k < 0:
+            new_block = True
+            probe[2] = z0 - dz
+        elif k > nK-1:
+            new_block = True
+            probe[2] = z0 + nK*dz
+        else:
+            probe[2] = DA[_z, 0, 0, k, ib]
+
+        valid[ic] = True
+        ibc = ib
+        if new_block:
+            ibc = _ccmc_block(batsclass, probe, last)
+            if ibc >= 0:
+                last = ibc
+                dx2 = DA[_x, 1, 0, 0, ibc] - DA[_x, 0, 0, 0, ibc]
+                dy2 = DA[_y, 0, 1, 0, ibc] - DA[_y, 0, 0, 0, ibc]
+                dz2 = DA[_z, 0, 0, 1, ibc] - DA[_z, 0, 0, 0, ibc]
+                i = min(nI-1, max(0, int(np.floor((x + (ic % 2)*dx2 - DA[_x, 0, 0, 0, ibc])/dx2))))
+                j = min(nJ-1, max(0, int(np.floor((y + ((ic//2) % 2)*dy2 - DA[_y, 0, 0, 0, ibc])/dy2))))
+                k = min(nK-1, max(0, int(np.floor((z + (ic//4)*dz2 - DA[_z, 0, 0, 0, ibc])/dz2))))
+                probe[0] = DA[_x, i, 0, 0, ibc]
+                probe[1] = DA[_y, 0, j, 0, ibc]
+                probe[2] = DA[_z, 0, 0, k, ibc]
+            else:
+                valid[ic] = False
+                ibc = ib
+                i = nI//2
+                j = nJ//2
+                k = nK//2
+                probe[:] = np.nan
+        cell[ic, 0] = i
+        cell[ic, 1] = j
+        cell[ic, 2] = k
+        cell[ic, 3] = ibc
+        pos[ic, :] = probe
+
+    for v in range(iVars.size):
+        for ic in range(8):
+            data[ic] = DA[iVars[v], cell[ic, 0], cell[ic, 1], cell[ic, 2], cell[ic, 3]]
+            ok[ic] = valid[ic]
+        ys[:] = np.nan
+        zs[:] = np.nan
+
+        # Pairs in x; where the two positions (nearly) coincide or one is
+        # not valid, take a valid one, preferring the lower.
+        for ic in range(4):
+            a = 2*ic
+            b = a + 1
+            d1 = x - pos[a, 0]
+            d2 = pos[b, 0] - x
+            if abs(d1 + d2) > dx/4.:
+                data[ic] = (d2*data[a] + d1*data[b])/(d1 + d2)
+                ys[ic] = (d2*pos[a, 1] + d1*pos[b, 1])/(d1 + d2)
+                zs[ic] = (d2*pos[a, 2] + d1*pos[b, 2])/(d1 + d2)
+                ok[ic] = True
+            else:
+                found = False
+                if ok[b]:
+                    data[ic] = data[b]
+                    ys[ic] = pos[b, 1]
+                    zs[ic] = pos[b, 2]
+                    found = True
+                if ok[a]:
+                    data[ic] = data[a]
+                    ys[ic] = pos[a, 1]
+                    zs[ic] = pos[a, 2]
+                    found = True
+                ok[ic] = found
+
+        # Pairs in y
+        for ic in range(2):
+            a = 2*ic
+            b = a + 1
+            d1 = y - ys[a]
+            d2 = ys[b] - y
+            if abs(d1 + d2) >= dy/4.:
+                zs[ic] = (d2*zs[a] + d1*zs[b])/(d1 + d2)
+                data[ic] = (d2*data[a] + d1*data[b])/(d1 + d2)
+                ok[ic] = True
+            else:
+                found = False
+                if ok[b]:
+                    data[ic] = data[b]
+                    zs[ic] = zs[b]
+                    found = True
+                if ok[a]:
+                    data[ic] = data[a]
+                    zs[ic] = zs[a]
+                    found = True
+                ok[ic] = found
+
+        # z; here the library prefers the upper value
+        d1 = z - zs[0]
+        d2 = zs[1] - z
+        found = True
+        if abs(d1 + d2) >= dz/4.:
+            data[0] = (d2*data[0] + d1*data[1])/(d1 + d2)
+        elif ok[1]:
+            data[0] = data[1]
+        elif not ok[0]:
+            found = False
+
+        out[v] = data[0] if found else np.nan
+
+# Held while _interpolate_ccmc() runs. The workqueue threading layer of
+# numba aborts when parallel kernels run in two threads at once, so
+# batsrus_interpolator.interp() runs the batch serially instead when it is
+# taken.
+_ccmc_parallel_lock = threading.Lock()
+
+# Points per work item of the batch kernels, which allocate the work arrays
+# of _ccmc_point() once per item.
+_ccmc_chunk = 1024
+
+@numba.njit(parallel=True)
+def _interpolate_ccmc(batsclass, points, iVars, out):
+    '''_ccmc_point() for each row of points, in parallel.'''
+    nChunk = (points.shape[0] + _ccmc_chunk - 1)//_ccmc_chunk
+    for iChunk in numba.prange(nChunk):
+        _interpolate_ccmc_range(batsclass, points, iVars, out, iChunk*_ccmc_chunk,
+                                min((iChunk + 1)*_ccmc_chunk, points.shape[0]))
+
+@numba.njit(nogil=True)
+def _interpolate_ccmc_serial(batsclass, points, iVars, out):
+    '''_ccmc_point() for each row of points, in the calling thread and
+    without the GIL.'''
+    _interpolate_ccmc_range(batsclass, points, iVars, out, 0, points.shape[0])
+
+@numba.njit
+def _interpolate_ccmc_range(batsclass, points, iVars, out, n0, n1):
+    _x = batsclass.varidx['x']
+    _y = batsclass.varidx['y']
+    _z = batsclass.varidx['z']
+    scratch = _ccmc_scratch()
+    for n in range(n0, n1):
+        _ccmc_point(batsclass, batsclass.DataArray, _x, _y, _z,
+                    points[n, 0], points[n, 1], points[n, 2], iVars, out[n], scratch)
+
 
 class batsrus_interpolator():
     """Class to interpolate BATSRUS results.  Heavily-based on Kamodo code
     written by Rebecca Ringuette.  Based on code in Kamodo swmfgm_4D.py and
     the associated OCTREE_BLOCK_GRID library.
+
+    With engine='numba', the OCTREE library is not used: its
+    interpolate_amrdata() is reimplemented in numba on the arrays of the
+    BatsrusClass, with the same choice of cells at changes of resolution,
+    so both engines give the same values (to float32 rounding). The
+    exception is within half a cell of the outer boundary of the domain,
+    where some cells of the stencil are outside of it; the library then
+    reads values it has not set (the result depends on the points
+    interpolated before), while the numba engine leaves those cells out.
+    Batches run in parallel. Numba's parallel kernels may only run in one
+    thread at a time with its workqueue threading layer, so while one
+    interpolator runs a batch in parallel, batches of other threads run
+    serially in their own thread (without the GIL). Points outside of the
+    domain are NaN.
     '''
 
     """
-    def __init__(self, batsrus):
+    def __init__(self, batsrus, engine='octree'):
         """Initialize batsrus_interpolator class
             
         Inputs:
             batsrus = class swmfio reading of BATSRUS file, contains SWMF results
+
+            engine = 'octree' to use the CCMC OCTREE library, 'numba' to use
+                the swmfio numba implementation of it.
                  
         Outputs:
             None
         """
         # logging.info('Initializing batsrus interpolator class') 
 
+        if engine not in ('octree', 'numba'):
+            raise ValueError(f"engine must be 'octree' or 'numba', not '{engine}'")
+        if engine == 'octree' and lib is None:
+            raise ImportError("The CCMC OCTREE library is not built; see "
+                              "README-Interpolator.txt, or use engine='numba'.")
+
         # Store instance data
         self.batsrus = batsrus
+        self.engine = engine
         self.octree = {}
         self.var_data = {}
         
         self.var_dict = dict(self.batsrus.varidx)
 
-        self.x = np.array(self.batsrus.data_arr[:, self.var_dict['x']][:])
-        self.y = np.array(self.batsrus.data_arr[:, self.var_dict['y']][:])
-        self.z = np.array(self.batsrus.data_arr[:, self.var_dict['z']][:])
+        # Process pool for interp(..., nthreads > 1), see _octree_pool()
+        self._pool = None
+
+        if engine == 'numba':
+            return
+
+        self.x = self._column('x')
+        self.y = self._column('y')
+        self.z = self._column('z')
 
         return
 
+    def _column(self, varname):
+        '''Contiguous float32 copy of a column of data_arr, for passing to the
+        library with ffi.from_buffer() (no conversion to a Python list).'''
+        return np.ascontiguousarray(self.batsrus.data_arr[:, self.var_dict[varname]], dtype=np.float32)
+
     def setup_octree(self, xx, yy, zz):
         '''
         This function requires _interpolate_amrdata*.so in
@@ -57,11 +503,14 @@ class batsrus_interpolator():
 
         N_blks = int(len(xx)/(NX*NY*NZ))
 
-        # initialize cffi arrays with Python lists may be slightly faster
+        # The library reads the cell centers in place. They are kept with
+        # the octree, as xyz_ranges() runs again when the library is set up
+        # for this octree after another one (see _use_octree()).
         self.octree = {}
-        x = ffi.new("float[]", list(xx))
-        y = ffi.new("float[]", list(yy))
-        z = ffi.new("float[]", list(zz))
+        self.octree['x'] = np.ascontiguousarray(xx, dtype=np.float32)
+        self.octree['y'] = np.ascontiguousarray(yy, dtype=np.float32)
+        self.octree['z'] = np.ascontiguousarray(zz, dtype=np.float32)
+        self.octree['Ncell'] = Ncell
         # 2 elements per block, smallest blocks have 2x2x2=8 positions
         # at cell corners (GUMICS), so maximum array size is N/4
         # BATSRUS blocks have at least 4x4x4 cell centers
@@ -76,27 +525,24 @@ class batsrus_interpolator():
         self.octree['NY'] = ffi.new("int[]", [NY])
         self.octree['NZ'] = ffi.new("int[]", [NZ])
 
-        N_blks = lib.xyz_ranges(Ncell, x, y, z, self.octree['xr_blk'],
-                                self.octree['yr_blk'], self.octree['zr_blk'],
-                                self.octree['x_blk'], self.octree['y_blk'],
-                                self.octree['z_blk'], self.octree['box_range'],
-                                self.octree['NX'], self.octree['NY'],
-                                self.octree['NZ'], 1)
+        N_blks = _xyz_ranges(self.octree)
 
         if N_blks < 0:
-            print('NX:', list(self.octree['NX']))
-            print('NY:', list(self.octree['NY']))
-            print('NZ:', list(self.octree['NZ']))
-            print('Y:', list(y[0:16]))
-            print('Z:', list(z[0:16]))
-            print('X_blk:', list(self.octree['x_blk'][0:16]))
-            print('Y_blk:', list(self.octree['y_blk'][0:16]))
-            print('Z_blk:', list(self.octree['z_blk'][0:16]))
+            swmfio.logger.debug(f"NX: {list(self.octree['NX'])}")
+            swmfio.logger.debug(f"NY: {list(self.octree['NY'])}")
+            swmfio.logger.debug(f"NZ: {list(self.octree['NZ'])}")
+            swmfio.logger.debug(f"Y: {list(self.octree['y'][0:16])}")
+            swmfio.logger.debug(f"Z: {list(self.octree['z'][0:16])}")
+            swmfio.logger.debug(f"X_blk: {list(self.octree['x_blk'][0:16])}")
+            swmfio.logger.debug(f"Y_blk: {list(self.octree['y_blk'][0:16])}")
+            swmfio.logger.debug(f"Z_blk: {list(self.octree['z_blk'][0:16])}")
             raise IOError("Block shape and size was not determined.")
 
         self.octree['N_blks'] = ffi.new("int[]", [N_blks])
+        self.octree['box'] = np.frombuffer(ffi.buffer(self.octree['box_range']), dtype=np.float32)[0:6].copy()
 
         N_octree = int(N_blks*8/7)
+        self.octree['N_octree'] = N_octree
         self.octree['octree_blocklist'] = ffi.new("octree_block[]", N_octree)
 
         dx_blk = np.zeros(N_blks, dtype=float)
@@ -138,14 +584,7 @@ class batsrus_interpolator():
                                                    N_blks*(MAX_AMRLEVEL+1))
         self.octree['block_at_AMRlevel'] = ffi.new("int[]",
                                               N_blks*(MAX_AMRLEVEL+1))
-        success = int(-1)
-        success = lib.setup_octree(N_blks,
-                                   self.octree['xr_blk'], self.octree['yr_blk'],
-                                   self.octree['zr_blk'], MAX_AMRLEVEL,
-                                   self.octree['box_range'],
-                                   self.octree['octree_blocklist'], N_octree,
-                                   self.octree['numparents_at_AMRlevel'],
-                                   self.octree['block_at_AMRlevel'])
+        _setup_octree(self.octree)
 
         return (self.octree)
 
@@ -153,25 +592,44 @@ class batsrus_interpolator():
         '''Creates interpolator for the indicated dataset.'''
 
         # logging.info('Initializing batsrus interpolator variable') 
+
+        if self.engine == 'numba':
+            # Values are read from batsrus.DataArray; only check the name.
+            self.var_data[varname] = self.var_dict[varname]
+            return
              
-        # initialize octree object
+        # initialize octree object, or reuse the one of a snapshot with the
+        # same grid
         if not self.octree:
-            self.octree = self.setup_octree(self.x, self.y, self.z)
-
-            # update which octree arrays the library points to
-            lib.setup_octree_pointers(self.octree['MAX_AMRLEVEL'],
-                                      self.octree['octree_blocklist'],
-                                      self.octree['numparents_at_AMRlevel'],
-                                      self.octree['block_at_AMRlevel'])
+            key = grid_fingerprint(self.batsrus)
+            with _octree_lock:
+                if key in _octree_cache:
+                    self.octree = _octree_cache[key]
+                else:
+                    self.octree = self.setup_octree(self.x, self.y, self.z)
+                    while len(_octree_cache) >= _octree_cache_size:
+                        del _octree_cache[next(iter(_octree_cache))]
+                    _octree_cache[key] = self.octree
 
         # store varname data to be interpolated in dictionary
-        self.var_data[varname] = ffi.new("float[]", 
-                    list(self.batsrus.data_arr[:, self.var_dict[varname]][:]))
+        self.var_data[varname] = self._column(varname)
 
         return
 
     # assign custom interpolator: Lutz Rastaetter 2021
-    def interp(self, xvec, varname):
+    def interp(self, xvec, varname, nthreads=None):
+        '''Interpolate varname at the points in xvec, a point [x, y, z] or a
+        list or (N, 3) array of points. Returns a float32 NumPy array of
+        shape (N,), or (N, nvars) if varname is a list or tuple of
+        registered variables.
+
+        With engine='numba', points are processed in parallel by nthreads
+        threads (default: all of numba's threads), or in the calling thread
+        while another thread runs a parallel batch. The OCTREE library is
+        not reentrant, so with engine='octree' calls in one process are
+        serialized; nthreads larger than 1 splits the points across that
+        many worker processes instead, which are started on the first such
+        call (each sets up the octree once) and kept until close().'''
         if not isinstance(xvec, np.ndarray):
             xvec = np.array(xvec)
 
@@ -181,19 +639,89 @@ class batsrus_interpolator():
             Y = np.array([Y])
             Z = np.array([Z])
 
-        xpos = ffi.new("float[]", list(X))
-        ypos = ffi.new("float[]", list(Y))
-        zpos = ffi.new("float[]", list(Z))
+        multi = isinstance(varname, (list, tuple))
+        varnames = list(varname) if multi else [varname]
+
+        if self.engine == 'numba':
+            for name in varnames:
+                if name not in self.var_data:
+                    raise KeyError(f"{name} is not registered; call register_variable('{name}') first")
+            # The library takes float32 positions
+            points = np.column_stack((X, Y, Z)).astype(np.float32).astype(np.float64)
+            iVars = _var_indices(self.batsrus.varidx, tuple(varnames))
+            return_data = np.empty((points.shape[0], len(varnames)), dtype=np.float32)
+            if nthreads == 1 or not _ccmc_parallel_lock.acquire(blocking=False):
+                _interpolate_ccmc_serial(self.batsrus, points, iVars, return_data)
+            else:
+                threads = numba.get_num_threads()
+                try:
+                    if nthreads is not None:
+                        numba.set_num_threads(min(nthreads, numba.config.NUMBA_NUM_THREADS))
+                    _interpolate_ccmc(self.batsrus, points, iVars, return_data)
+                finally:
+                    numba.set_num_threads(threads)
+                    _ccmc_parallel_lock.release()
+            if multi:
+                return return_data
+            return return_data[:, 0]
+
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        Y = np.ascontiguousarray(Y, dtype=np.float32)
+        Z = np.ascontiguousarray(Z, dtype=np.float32)
         npos = len(X)
-        return_data = list(np.zeros(npos, dtype=float))
-        return_data_ffi = ffi.new("float[]", return_data)
-
-        IS_ERROR = lib.interpolate_amrdata_multipos(
-            xpos, ypos, zpos, npos, self.var_data[varname], return_data_ffi)
-        if IS_ERROR != 0:
-            print("Warning: SWMF/BATSRUS interpolation failed.")
-
-        return_data[:] = list(return_data_ffi)
-
-        return return_data
 
+        if nthreads is not None and nthreads > 1:
+            for name in varnames:
+                if name not in self.var_data:
+                    raise KeyError(f"{name} is not registered; call register_variable('{name}') first")
+            chunks = np.array_split(np.arange(npos), nthreads)
+            results = self._octree_pool(nthreads).starmap(
+                _octree_worker_interp, [(X[c], Y[c], Z[c], varnames) for c in chunks])
+            return_data = np.concatenate([values for values, failed in results], axis=1)
+            failed = sum(failed for values, failed in results)
+        else:
+            return_data, failed = self._interp_octree(X, Y, Z, varnames)
+        if failed > 0:
+            swmfio.logger.warning(f"SWMF/BATSRUS interpolation failed at {failed} of {npos} "
+                                  "points inside the grid.")
+
+        if multi:
+            return return_data.T
+        return return_data[0]
+
+    def _interp_octree(self, X, Y, Z, varnames):
+        '''Interpolate the registered varnames at the float32 points X, Y, Z
+        with the library. Returns the values, one row per variable, and the
+        number of points inside the grid where it failed.'''
+
+        # The library writes the results directly into return_data, one
+        # contiguous column per variable.
+        return_data = np.zeros((len(varnames), len(X)), dtype=np.float32)
+
+        fields = tuple(self.var_data[name] for name in varnames)
+        with _octree_lock:
+            _use_octree(self.octree)
+            failed = _interpolate_octree(X, Y, Z, fields, self.octree['box'], return_data)
+
+        return return_data, failed
+
+    def _octree_pool(self, nprocs):
+        '''Pool of nprocs worker processes, each with the octree of this
+        snapshot set up, kept until close().'''
+        if self._pool is not None and self._pool[0] != nprocs:
+            self.close()
+        if self._pool is None:
+            handle = swmfio.export_shared(self.batsrus)
+            # 'spawn': forking while numba's thread pool runs can deadlock
+            pool = multiprocessing.get_context('spawn').Pool(
+                nprocs, initializer=_octree_worker_init, initargs=(handle, list(self.var_data)))
+            self._pool = (nprocs, pool, weakref.finalize(self, _close_octree_pool, pool, handle))
+        return self._pool[1]
+
+    def close(self):
+        '''Stop the worker processes of interp(..., nthreads > 1) and release
+        the shared memory they used. Also done when the interpolator is
+        garbage collected.'''
+        if self._pool is not None:
+            self._pool[2]()
+            self._pool = None
@@ -0,0 +1,82 @@
+'''Entry points to BatsrusClass that release the GIL, for programs in which
+several Python threads query one loaded snapshot, e.g.,
+
+    from concurrent.futures import ThreadPoolExecutor
+    from swmfio import batsrus_nogil
+
+    batsclass = swmfio.read_batsrus(file)
+    chunks = np.array_split(points, nthreads)
+    with ThreadPoolExecutor(nthreads) as pool:
+        rho = np.concatenate(list(pool.map(
+                lambda chunk: batsrus_nogil.interpolate_many(batsclass, chunk, 'rho'), chunks)))
+
+The functions take the class instance and work on its arrays in place, so
+the data are shared by all threads (no copy per thread or process).
+
+A loaded BatsrusClass is safe for concurrent use by these functions and by
+its query methods (find_tree_node, interpolate*, plan,
+get_native_partial_derivatives), because they only read it. Do not
+modify it or call the build_* functions or reorder_blocks() while other
+threads use it. BlockLocator instances keep state; use one per thread.
+
+The batch functions here are serial; the threads provide the parallelism.
+(The parallel BatsrusClass batch methods use numba's thread pool, which
+must not be entered from several threads at once with the default
+workqueue threading layer.)
+'''
+
+import numpy as np
+import numba
+
+from swmfio.batsrus_class import _interpolate_point, _values, _var_indices
+
+
+@numba.njit(nogil=True)
+def find_tree_node(batsclass, point):
+    return batsclass.find_tree_node(point)
+
+
+@numba.njit(nogil=True)
+def interpolate(batsclass, point, var):
+    return batsclass.interpolate(point, var)
+
+
+@numba.njit(nogil=True)
+def get_native_partial_derivatives(batsclass, indx, var, across_blocks=False):
+    return batsclass.get_native_partial_derivatives(indx, var, across_blocks)
+
+
+@numba.njit(nogil=True)
+def interpolate_many(batsclass, points, var, fill=np.nan):
+    '''BatsrusClass.interpolate_many() without the GIL, in the calling
+    thread.'''
+
+    iVars = _var_indices(batsclass.varidx, (var,))
+
+    return _interpolate_serial(batsclass, points, iVars, fill)[:, 0]
+
+
+@numba.njit(nogil=True)
+def interpolate_many_vars(batsclass, points, variables, fill=np.nan):
+    '''BatsrusClass.interpolate_many_vars() without the GIL, in the calling
+    thread.'''
+
+    iVars = _var_indices(batsclass.varidx, variables)
+
+    return _interpolate_serial(batsclass, points, iVars, fill)
+
+
+@numba.njit(nogil=True)
+def _interpolate_serial(batsclass, points, iVars, fill):
+
+    _x = batsclass.varidx['x']
+    _y = batsclass.varidx['y']
+    _z = batsclass.varidx['z']
+
+    DA = _values(batsclass)
+
+    out = np.empty((points.shape[0], iVars.size), dtype=np.float64)
+    for n in range(points.shape[0]):
+        _interpolate_point(batsclass, DA, _x, _y, _z, points[n], iVars, fill, 0., out[n])
+
+    return out
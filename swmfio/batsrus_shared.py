@@ -0,0 +1,191 @@
+import sys
+import numpy as np
+from multiprocessing import shared_memory
+
+# Array attributes of BatsrusClass that are copied to shared memory. DataArray
+# is a view of data_arr and is re-created from it on attach.
+shared_arrays = [
+                    'amr_level_0_nodes',
+                    'block_parent_id'  ,
+                    'block_child_ids'  ,
+                    'block_amr_levels' ,
+                    'block_x_min'      ,
+                    'block_y_min'      ,
+                    'block_z_min'      ,
+                    'block_x_max'      ,
+                    'block_y_max'      ,
+                    'block_z_max'      ,
+                    'block_child_count',
+                    'data_arr'         ,
+                    'block2node'       ,
+                    'node2block'       ,
+                ]
+
+# Attributes that are not constructor arguments; they are set after the class
+# is created on attach. halo is a view of halo_arr and is re-created from it.
+shared_attributes = [
+                    'lookup_grid',
+                    'lookup_dx'  ,
+                    'lookup_dy'  ,
+                    'lookup_dz'  ,
+                    'morton_keys' ,
+                    'morton_nodes',
+                    'morton_n'    ,
+                    'morton_dx'   ,
+                    'morton_dy'   ,
+                    'morton_dz'   ,
+                    'halo_arr'    ,
+                    'neighbor_dlevel',
+                    'neighbor_blocks',
+                    'block_file_order',
+                    'rBody'          ,
+                ]
+
+shared_scalars = [
+                    'nDim'      ,
+                    'nI'        ,
+                    'nJ'        ,
+                    'nK'        ,
+                    'xGlobalMin',
+                    'yGlobalMin',
+                    'zGlobalMin',
+                    'xGlobalMax',
+                    'yGlobalMax',
+                    'zGlobalMax',
+                ]
+
+# Offsets of arrays in the shared block are multiples of this (cache line).
+_ALIGN = 64
+
+# SharedMemory objects must stay open while arrays in them are in use.
+# Segments created in this process by export_shared(), keyed by name.
+_exported = {}
+# Segments attached in this process and the classes built on them.
+_attached = {}
+# Segments that were unlinked while arrays in them were still referenced.
+_released = []
+
+
+class SharedBatsrus():
+    """Picklable handle to a BatsrusClass snapshot that was copied into one
+    multiprocessing.shared_memory segment by export_shared(). Pass it to
+    worker processes and call attach() there to get a BatsrusClass whose
+    arrays are views of the shared segment (no copy).
+
+    The process that called export_shared() owns the segment and must call
+    unlink() when the workers are done with it. If numba parallel kernels
+    (e.g., interpolate_many) have run in that process, create the pool with
+    the 'spawn' or 'forkserver' start method; forking while the numba thread
+    pool is running can deadlock.
+    """
+    def __init__(self, name, layout, scalars, varidx, file):
+        self.name = name
+        self.layout = layout
+        self.scalars = scalars
+        self.varidx = varidx
+        self.file = file
+
+    def attach(self):
+        return attach_shared(self)
+
+    def unlink(self):
+        """Release the segment. Call in the process that exported it."""
+        _attached.pop(self.name, None)
+        shm = _exported.pop(self.name, None)
+        if shm is not None:
+            try:
+                shm.close()
+            except BufferError:
+                # A class attached in this process is still referenced; keep
+                # the mapping alive for it. The name is removed regardless.
+                _released.append(shm)
+            shm.unlink()
+
+
+def export_shared(batsclass):
+    """Copy the data and tree arrays of batsclass into a new shared memory
+    segment and return a picklable SharedBatsrus handle to it.
+    """
+
+    names = shared_arrays + [name for name in shared_attributes
+                                if isinstance(getattr(batsclass, name), np.ndarray)]
+
+    layout = {}
+    nbytes = 0
+    for name in names:
+        arr = getattr(batsclass, name)
+        order = 'F' if np.isfortran(arr) else 'C'
+        layout[name] = (arr.dtype.str, arr.shape, order, nbytes)
+        nbytes += -(-arr.nbytes // _ALIGN) * _ALIGN
+
+    shm = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+    _exported[shm.name] = shm
+
+    for name in names:
+        _view(shm, layout[name])[...] = getattr(batsclass, name)
+
+    scalars = {name: getattr(batsclass, name) for name in shared_scalars}
+    scalars.update({name: getattr(batsclass, name) for name in shared_attributes
+                        if name not in layout})
+
+    return SharedBatsrus(shm.name, layout, scalars, dict(batsclass.varidx), batsclass.file)
+
+
+def attach_shared(handle):
+    """Return a BatsrusClass backed by the shared segment of handle. The class
+    is cached, so repeated calls in a process are cheap.
+    """
+
+    if handle.name in _attached:
+        return _attached[handle.name][1]
+
+    import numba
+    from swmfio.batsrus_class import BatsrusClass, _halo_view
+
+    if handle.name in _exported:
+        shm = _exported[handle.name]
+    elif sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=handle.name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=handle.name)
+
+    arrays = {name: _view(shm, handle.layout[name]) for name in shared_arrays}
+
+    data_arr = arrays['data_arr']
+    nI, nJ, nK = handle.scalars['nI'], handle.scalars['nJ'], handle.scalars['nK']
+    nBlock = data_arr.shape[0]//(nI*nJ*nK)
+    DataArray = data_arr.transpose().reshape((data_arr.shape[1], nI, nJ, nK, nBlock), order='F')
+    assert(np.shares_memory(DataArray, data_arr))
+
+    varidx = numba.typed.Dict.empty(
+                    key_type=numba.types.unicode_type,
+                    value_type=numba.types.int32,
+        )
+    for var, ivar in handle.varidx.items():
+        varidx[var] = np.int32(ivar)
+
+    batsclass = BatsrusClass(
+                      **{name: handle.scalars[name] for name in shared_scalars},
+                      **arrays,
+                      DataArray = DataArray,
+                      varidx    = varidx,
+                      file      = handle.file
+                )
+
+    for name in shared_attributes:
+        if name in handle.layout:
+            setattr(batsclass, name, _view(shm, handle.layout[name]))
+        else:
+            setattr(batsclass, name, handle.scalars[name])
+
+    if batsclass.halo_arr.size > 0:
+        batsclass.halo = _halo_view(batsclass.halo_arr, nI, nJ, nK)
+
+    _attached[handle.name] = (shm, batsclass)
+
+    return batsclass
+
+
+def _view(shm, entry):
+    dtype, shape, order, offset = entry
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset, order=order)
@@ -0,0 +1,112 @@
+import numpy as np
+
+
+class SpaceTimeInterpolator():
+    """Interpolate in space and time through a sequence of BATSRUS outputs,
+    e.g., along a satellite trajectory that spans many files.
+
+    Values at time t between the times of two consecutive outputs are
+    interpolated linearly in time between the values interpolated in space
+    in each output. At most two outputs are loaded at a time: samples are
+    processed in order of time, so each file is read once however long
+    the trajectory is. When the two outputs have the same grid (as
+    consecutive outputs of a run without AMR changes do), points are
+    located once and the interpolation weights are reused for both
+    (see BatsrusClass.plan()).
+
+    Usage:
+        sti = SpaceTimeInterpolator(files, times)
+        values = sti.interpolate(t, points, ('bx', 'by', 'bz'))
+
+    files: outputs, in any format read by swmfio.read_batsrus().
+    times: time of each file (any increasing numbers, e.g., seconds since
+        the start of the run), in the same units as t in interpolate().
+    loader: function that reads a file; default swmfio.read_batsrus. Use,
+        e.g., functools.partial(swmfio.read_batsrus, halo=True) for load
+        options.
+    """
+    def __init__(self, files, times, loader=None):
+
+        times = np.asarray(times, dtype=np.float64)
+        assert len(files) == times.size and times.size > 0
+        assert np.all(np.diff(times) > 0), "times must be increasing"
+
+        if loader is None:
+            import swmfio
+            loader = swmfio.read_batsrus
+
+        self.files = list(files)
+        self.times = times
+        self.loader = loader
+
+        # Loaded outputs, keyed by index in files
+        self.window = {}
+        self.plan_reuses = 0
+
+    def snapshot(self, i):
+        """Output i, loaded if it is not in the window."""
+        if i not in self.window:
+            self.window[i] = self.loader(self.files[i])
+        return self.window[i]
+
+    def interpolate(self, t, points, variables, fill=np.nan):
+        """Values of each of variables (a tuple of names) at times t, shape
+        (N,), and points, shape (N, 3). Returns an (N, nvars) array.
+        Samples outside of the time range of the files, or of the domain,
+        are fill."""
+
+        t = np.asarray(t, dtype=np.float64)
+        points = np.asarray(points, dtype=np.float64)
+        variables = tuple(variables)
+
+        out = np.full((t.size, len(variables)), fill, dtype=np.float64)
+
+        # Interval [times[i], times[i+1]] of each sample; a sample at the
+        # last time is in the last interval.
+        interval = np.searchsorted(self.times, t, side='right') - 1
+        interval[t == self.times[-1]] = self.times.size - 2
+        valid = (t >= self.times[0]) & (t <= self.times[-1])
+
+        if self.times.size == 1:
+            if np.any(valid):
+                out[valid] = self.snapshot(0).interpolate_many_vars(points[valid], variables, fill)
+            return out
+
+        for i in np.unique(interval[valid]):
+            samples = np.nonzero(valid & (interval == i))[0]
+            for j in list(self.window):
+                if j not in (i, i + 1):
+                    del self.window[j]
+
+            s0 = self.snapshot(i)
+            s1 = self.snapshot(i + 1)
+            p = points[samples]
+            if same_grid(s0, s1):
+                plan = s0.plan(p)
+                v0 = plan.apply_vars(s0, variables, fill)
+                v1 = plan.apply_vars(s1, variables, fill)
+                self.plan_reuses += 1
+            else:
+                v0 = s0.interpolate_many_vars(p, variables, fill)
+                v1 = s1.interpolate_many_vars(p, variables, fill)
+
+            w = ((t[samples] - self.times[i])/(self.times[i + 1] - self.times[i]))[:, np.newaxis]
+            out[samples] = (1. - w)*v0 + w*v1
+
+        return out
+
+
+def same_grid(a, b):
+    """True if BatsrusClass instances a and b have the same tree and blocks
+    in the same order, so that interpolation weights computed for one
+    apply to the other."""
+
+    if (a.nI, a.nJ, a.nK) != (b.nI, b.nJ, b.nK):
+        return False
+    if (a.halo.size > 0) != (b.halo.size > 0):
+        return False
+    for name in ('block2node', 'block_child_ids', 'block_amr_levels',
+                 'block_x_min', 'block_y_min', 'block_z_min'):
+        if not np.array_equal(getattr(a, name), getattr(b, name)):
+            return False
+    return True
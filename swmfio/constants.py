@@ -14,6 +14,11 @@ Refined_     =  3 # refined child block
 CoarsenNew_  =  4 # parent block to be coarsened
 Coarsened_   =  5 # coarsened parent block
 
+# Status of points in batch interpolation
+PointOk_      = 0 # interpolated
+PointOutside_ = 1 # outside of the simulation domain
+PointInBody_  = 2 # inside the inner boundary (rBody)
+
 # Deepest AMR level relative to root nodes (limited by 32 bit integers)
 MaxLevel = 30
 
@@ -1,10 +1,28 @@
 import numpy as np
 import scipy.io as sio
 
-def read_batsrus(file):
+def read_batsrus(file, stats=None, lookup_grid=False, morton_index=False, halo=False,
+                    neighbors=False, reorder_blocks=False):
+    '''Read a BATSRUS native (.out, .tree, .info) or CCMC .cdf file.
+
+    stats: optional swmfio.ReadStats that is filled with per-phase timing.
+    lookup_grid: if True, or a size limit in bytes, also build the point
+        lookup grid (see swmfio.batsrus_class.build_lookup_grid).
+    morton_index: if True, also build the linear octree of leaves used for
+        point location (see swmfio.batsrus_class.build_morton_index).
+    halo: if True, also build the ghost cell layer used to interpolate
+        across block edges (see swmfio.batsrus_class.build_halo).
+    neighbors: if True, also build the table of the 26 neighbors of each
+        block (see swmfio.batsrus_class.build_neighbors).
+    reorder_blocks: if True, store blocks in Morton order instead of file
+        order (see swmfio.batsrus_class.reorder_blocks).
+    '''
 
     import os
     import swmfio
+    from swmfio.batsrus_class import build_lookup_grid, build_morton_index, build_halo, \
+                                     build_neighbors, _phase
+    from swmfio.batsrus_class import reorder_blocks as _reorder_blocks
 
 
     (dirname, fname, fext) = swmfio.util.fileparts(file)
@@ -13,15 +31,38 @@ def read_batsrus(file):
     swmfio.logger.info("Creating class for file = " + file)
     if fext == '.cdf':
         from swmfio.batsrus_class import get_class_from_cdf
-        cls = get_class_from_cdf(file)
-        swmfio.logger.info("Created class for file = " + file)
-        return cls 
+        cls = get_class_from_cdf(file, stats=stats)
     else:
         file = os.path.join(dirname, fname)
         from swmfio.batsrus_class import get_class_from_native
-        cls = get_class_from_native(file)
-        swmfio.logger.info("Created class for file = " + file)
-        return cls
+        cls = get_class_from_native(file, stats=stats)
+
+    if reorder_blocks:
+        # Before the structures that are indexed by block
+        with _phase(stats, 'block reordering'):
+            _reorder_blocks(cls)
+
+    if lookup_grid is not False:
+        with _phase(stats, 'lookup grid'):
+            if lookup_grid is True:
+                build_lookup_grid(cls)
+            else:
+                build_lookup_grid(cls, max_bytes=lookup_grid)
+
+    if morton_index and cls.morton_keys.size == 0:
+        with _phase(stats, 'Morton index'):
+            build_morton_index(cls)
+
+    if halo:
+        with _phase(stats, 'halo'):
+            build_halo(cls)
+
+    if neighbors:
+        with _phase(stats, 'neighbor table'):
+            build_neighbors(cls)
+
+    swmfio.logger.info("Created class for file = " + file)
+    return cls
 
 
 def read_tree(filetag):
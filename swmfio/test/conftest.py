@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+# Small native BATSRUS output used by the tests that cannot download the demo
+# files: one root node refined once, with its first child refined again, so
+# that 7 level-1 and 8 level-2 blocks of 4x4x4 cells tile [-32, 32]^3. Fields
+# are linear in x, y, z so that trilinear interpolation and centered
+# differences are exact inside a block.
+
+nI = 4
+xGlobalMin = -32.
+xGlobalMax = 32.
+Unset_ = -100
+
+variables = ('x', 'y', 'z', 'rho', 'ux', 'uy', 'uz', 'bx', 'by', 'bz')
+
+def fields(x, y, z):
+    return {
+        'x'  : x,
+        'y'  : y,
+        'z'  : z,
+        'rho': 2. + 0.1*x - 0.05*y + 0.02*z,
+        'ux' : 0.5*x,
+        'uy' : 0.25*y,
+        'uz' : -0.75*z,
+        'bx' : y,
+        'by' : -x,
+        'bz' : 1. + 0*x,
+    }
+
+def _tree():
+
+    # Columns of iTree_IA for each node (Fortran indexing as in BATL)
+    # status, level, coords, parent, children
+    nodes = [[-1, 0, (1, 1, 1), Unset_, list(range(2, 10))]]
+    for iChild in range(8):
+        offset = (iChild % 2, (iChild//2) % 2, iChild//4)
+        coords = tuple(1 + o for o in offset)
+        children = list(range(10, 18)) if iChild == 0 else 8*[Unset_]
+        nodes.append([-1 if iChild == 0 else 1, 1, coords, 1, children])
+    for iChild in range(8):
+        offset = (iChild % 2, (iChild//2) % 2, iChild//4)
+        coords = tuple(1 + o for o in offset)
+        nodes.append([1, 2, coords, 2, 8*[Unset_]])
+
+    nNode = len(nodes)
+    iTree_IA = np.full((18, nNode), Unset_, dtype=np.int32)
+    for iNodeP, (status, level, coords, parent, children) in enumerate(nodes):
+        iTree_IA[0, iNodeP] = status
+        iTree_IA[1, iNodeP] = level
+        iTree_IA[6:9, iNodeP] = coords
+        iTree_IA[9, iNodeP] = parent
+        iTree_IA[10:18, iNodeP] = children
+
+    return iTree_IA
+
+def _leaf_bounds(iTree_IA):
+    bounds = []
+    for iNodeP in range(iTree_IA.shape[1]):
+        if iTree_IA[0, iNodeP] != 1:
+            continue
+        level = iTree_IA[1, iNodeP]
+        size = (xGlobalMax - xGlobalMin)/2**level
+        lo = xGlobalMin + size*(iTree_IA[6:9, iNodeP] - 1)
+        bounds.append((lo, size))
+    return bounds
+
+def write_native(filetag, seed=0):
+
+    from scipy.io import FortranFile
+
+    iTree_IA = _tree()
+    nNode = iTree_IA.shape[1]
+
+    with open(filetag + '.info', 'w') as f:
+        f.write('#HEADFILE\n')
+        f.write('3  nDim\n')
+        for iDim in (1, 2, 3):
+            f.write(f'{nI}  BlockSize{iDim}\n')
+        for iDim in (1, 2, 3):
+            f.write(f'{xGlobalMin}  Coord{iDim}Min\n')
+            f.write(f'{xGlobalMax}  Coord{iDim}Max\n')
+
+    ff = FortranFile(filetag + '.tree', 'w')
+    ff.write_record(np.array([3, iTree_IA.shape[0], nNode], dtype=np.int32))
+    ff.write_record(np.array([2, 2, 2], dtype=np.int32))
+    ff.write_record(np.array([1, 1, 1], dtype=np.int32))
+    ff.write_record(iTree_IA.ravel(order='F'))
+    ff.close()
+
+    # Blocks are written in a shuffled order so that block and node indices
+    # differ.
+    bounds = _leaf_bounds(iTree_IA)
+    order = np.random.default_rng(seed).permutation(len(bounds))
+    xyz = []
+    for iBlock in order:
+        lo, size = bounds[iBlock]
+        dx = size/nI
+        c = lo[:, None] + dx*(np.arange(nI) + 0.5)[None, :]
+        # i varies fastest
+        z, y, x = np.meshgrid(c[2], c[1], c[0], indexing='ij')
+        xyz.append(np.array([x.ravel(), y.ravel(), z.ravel()]))
+    xyz = np.concatenate(xyz, axis=1).astype(np.float32)
+    npts = xyz.shape[1]
+    values = fields(*xyz.astype(np.float64))
+
+    ff = FortranFile(filetag + '.out', 'w')
+    units = 'R R R Mp/cc km/s km/s km/s nT nT nT'
+    ff.write_record(np.frombuffer(units.ljust(79).encode(), dtype=np.uint8))
+    ff.write_record(np.array([0, 0, -3, 2, len(variables) - 3], dtype=np.int32))
+    ff.write_record(np.array([npts, 1, 1], dtype=np.int32))
+    ff.write_record(np.array([1., 2.5], dtype=np.float32))
+    names = ' '.join(variables) + ' g rbody'
+    ff.write_record(np.frombuffer(names.encode(), dtype=np.uint8))
+    ff.write_record(xyz.ravel())
+    for var in variables[3:]:
+        ff.write_record(values[var].astype(np.float32))
+    ff.close()
+
+    return filetag
+
+@pytest.fixture(scope='session')
+def native_file(tmp_path_factory):
+    return write_native(str(tmp_path_factory.mktemp('batsrus') / '3d__var_test'))
+
+@pytest.fixture(scope='session')
+def batsclass(native_file):
+    import swmfio
+    return swmfio.read_batsrus(native_file)
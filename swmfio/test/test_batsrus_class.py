@@ -0,0 +1,419 @@
+import numpy as np
+import pytest
+
+import swmfio
+
+
+def test_read_stats(native_file):
+    stats = swmfio.ReadStats()
+    batsclass = swmfio.read_batsrus(native_file, stats=stats)
+    assert batsclass.DataArray.shape[-1] == 15
+
+    phases = ['tree read', 'data read', 'DataArray reshaping', 'varidx creation',
+              'bounds arrays', 'numba compile', 'block2node construction']
+    assert list(stats.phases.keys()) == phases
+    assert stats.phases['data read']['bytes'] > 0
+    assert stats.phases['data read']['MB/s'] > 0
+    assert stats.time >= stats.phases['data read']['time']
+    assert 'block2node construction' in str(stats)
+
+
+def _random_points(n, seed=1):
+    return np.random.default_rng(seed).uniform(-32., 32., (n, 3))
+
+
+def test_interpolate_many(batsclass):
+    points = _random_points(2000)
+    expected = np.array([batsclass.interpolate(point, 'rho') for point in points])
+    assert np.array_equal(batsclass.interpolate_many(points, 'rho'), expected)
+
+    # Cell centers reproduce the stored values
+    cells = batsclass.data_arr[::7, 0:3].astype(np.float64)
+    rho = batsclass.data_arr[::7, dict(batsclass.varidx)['rho']]
+    assert np.allclose(batsclass.interpolate_many(cells, 'rho'), rho, rtol=1e-6)
+
+
+def test_interpolate_many_vars(batsclass):
+    points = _random_points(500)
+    variables = ('bx', 'by', 'bz', 'rho')
+    values = batsclass.interpolate_many_vars(points, variables)
+    assert values.shape == (500, 4)
+    for v, var in enumerate(variables):
+        assert np.array_equal(values[:, v], batsclass.interpolate_many(points, var))
+
+
+def test_block_locator(batsclass):
+    # A straight path through blocks of both levels
+    t = np.linspace(0., 1., 2000)[:, None]
+    points = np.array([-30.3, -29.1, -28.7]) + t*np.array([55., 50., 45.])
+
+    locator = swmfio.BlockLocator(batsclass)
+    nodes = [locator.find_tree_node(point) for point in points]
+    assert nodes == [batsclass.find_tree_node(point) for point in points]
+    assert locator.hit_rate() > 0.99
+    assert locator.hits + locator.parent_hits + locator.misses == len(points)
+
+    variables = ('bx', 'rho')
+    assert np.array_equal(locator.interpolate_many_vars(points, variables),
+                          batsclass.interpolate_many_vars(points, variables))
+    assert locator.interpolate(points[7], 'rho') == batsclass.interpolate(points[7], 'rho')
+
+    # Parent of a level-2 leaf is the refined level-1 node
+    iNode = batsclass.find_tree_node(np.array([-31., -31., -31.]))
+    assert batsclass.block_amr_levels[iNode - 1] == 2
+    iParent = batsclass.block_parent_id[iNode - 1]
+    assert iNode in batsclass.block_child_ids[:, iParent - 1]
+
+
+def test_lookup_grid(native_file):
+    from swmfio.batsrus_class import build_lookup_grid
+
+    batsclass = swmfio.read_batsrus(native_file)
+    points = _random_points(2000)
+    nodes = [batsclass.find_tree_node(point) for point in points]
+    expected = batsclass.interpolate_many(points, 'rho')
+
+    # Finest level (2) fits; grid cells then map straight to leaves
+    assert build_lookup_grid(batsclass) == 2
+    assert batsclass.lookup_grid.shape == (4, 4, 4)
+    assert np.all(batsclass.block_child_count[batsclass.lookup_grid - 1] == 0)
+    assert [batsclass.find_tree_node(point) for point in points] == nodes
+    assert np.array_equal(batsclass.interpolate_many(points, 'rho'), expected)
+
+    # Coarser grid under a memory cap; remaining levels are descended
+    assert build_lookup_grid(batsclass, max_bytes=4*2**3) == 1
+    assert [batsclass.find_tree_node(point) for point in points] == nodes
+
+    # Nothing fits; plain tree search
+    assert build_lookup_grid(batsclass, max_bytes=1) == -1
+    assert batsclass.lookup_grid.size == 0
+    assert [batsclass.find_tree_node(point) for point in points] == nodes
+
+
+def test_morton_index(native_file):
+    from swmfio.batsrus_class import build_morton_index
+
+    batsclass = swmfio.read_batsrus(native_file)
+    points = _random_points(2000)
+    nodes = batsclass.find_tree_nodes(points)
+    assert list(nodes) == [batsclass.find_tree_node(point) for point in points]
+
+    assert build_morton_index(batsclass) == 15
+    assert np.all(np.diff(batsclass.morton_keys.astype(np.int64)) > 0)
+    assert np.array_equal(batsclass.find_tree_nodes(points), nodes)
+
+    # Corners of the domain
+    corners = np.array([[-32., -32., -32.], [32., 32., 32.]])
+    for point in corners:
+        iNode = batsclass.find_tree_node(point)
+        assert batsclass.block_child_count[iNode - 1] == 0
+
+
+def test_halo(native_file):
+    from conftest import fields
+
+    batsclass = swmfio.read_batsrus(native_file, halo=True)
+    nI = batsclass.nI
+    assert np.array_equal(batsclass.halo[:, 1:nI+1, 1:nI+1, 1:nI+1, :], batsclass.DataArray)
+
+    # Fields are linear, so interpolation across block edges and AMR level
+    # changes is exact away from the domain boundary.
+    points = np.random.default_rng(2).uniform(-24., 24., (2000, 3))
+    values = batsclass.interpolate_many_vars(points, ('rho', 'bx', 'uz'))
+    expected = fields(*points.T)
+    for v, var in enumerate(('rho', 'bx', 'uz')):
+        assert np.allclose(values[:, v], expected[var], rtol=1e-5, atol=1e-5)
+
+
+def test_neighbors(native_file):
+    from swmfio.constants import Unset_
+
+    batsclass = swmfio.read_batsrus(native_file, neighbors=True)
+    dlevel = batsclass.neighbor_dlevel
+    blocks = batsclass.neighbor_blocks
+    nBlock = batsclass.block2node.size
+    assert dlevel.shape == (3, 3, 3, nBlock)
+    assert blocks.shape == (3, 3, 3, 4, nBlock)
+    assert np.all(blocks[1, 1, 1, 0] == np.arange(nBlock))
+
+    def block(point):
+        return batsclass.node2block[batsclass.find_tree_node(np.array(point)) - 1]
+
+    # Level 1 block at (+x, -y, -z); the refined octant is across its -x face
+    iBlockP = block([16., -16., -16.])
+    assert dlevel[0, 1, 1, iBlockP] == 1
+    assert sorted(blocks[0, 1, 1, :, iBlockP]) == sorted(block([-8., y, z]) for z in (-24., -8.) for y in (-24., -8.))
+    assert dlevel[2, 1, 1, iBlockP] == Unset_
+    assert np.all(blocks[2, 1, 1, :, iBlockP] == -1)
+
+    # ... and it is coarser than the finer blocks on the other side
+    iFineP = block([-8., -24., -24.])
+    assert dlevel[2, 1, 1, iFineP] == -1
+    assert blocks[2, 1, 1, 0, iFineP] == iBlockP
+    assert np.all(blocks[2, 1, 1, 1:, iFineP] == -1)
+
+    # Same level neighbors are symmetric
+    for iBlockP in range(nBlock):
+        for di, dj, dk in np.ndindex(3, 3, 3):
+            if dlevel[di, dj, dk, iBlockP] == 0:
+                iNeighborP = blocks[di, dj, dk, 0, iBlockP]
+                assert blocks[2-di, 2-dj, 2-dk, 0, iNeighborP] == iBlockP
+
+
+def test_interpolate_with_gradient(native_file):
+    batsclass = swmfio.read_batsrus(native_file, halo=True)
+
+    points = np.random.default_rng(3).uniform(-24., 24., (500, 3))
+    values, gradients = batsclass.interpolate_many_vars_with_gradient(points, ('rho', 'bx', 'by'))
+    assert np.allclose(values, batsclass.interpolate_many_vars(points, ('rho', 'bx', 'by')))
+
+    # Gradients of the linear fields in conftest.fields()
+    assert np.allclose(gradients[:, 0], [0.1, -0.05, 0.02], atol=1e-5)
+    assert np.allclose(gradients[:, 1], [0., 1., 0.], atol=1e-5)
+    assert np.allclose(gradients[:, 2], [-1., 0., 0.], atol=1e-5)
+
+    value, gradient = batsclass.interpolate_with_gradient(points[0], 'rho')
+    assert np.isclose(value, values[0, 0])
+    assert np.array_equal(gradient, gradients[0, 0])
+
+    rho, grad_rho = batsclass.interpolate_many_with_gradient(points, 'rho')
+    assert np.array_equal(rho, values[:, 0])
+    assert np.array_equal(grad_rho, gradients[:, 0])
+
+    # Without a halo, the stencil is clamped at block edges and one-sided
+    # differences are used there; these are also exact for linear fields.
+    batsclass = swmfio.read_batsrus(native_file)
+    values, gradients = batsclass.interpolate_many_vars_with_gradient(points, ('rho', 'bx', 'by'))
+    assert np.allclose(values, batsclass.interpolate_many_vars(points, ('rho', 'bx', 'by')))
+    assert np.allclose(gradients[:, 0], [0.1, -0.05, 0.02], atol=1e-5)
+    assert np.allclose(gradients[:, 1], [0., 1., 0.], atol=1e-5)
+    assert np.allclose(gradients[:, 2], [-1., 0., 0.], atol=1e-5)
+
+
+def test_masked_batch(batsclass):
+    from swmfio.constants import PointOk_, PointOutside_, PointInBody_
+
+    assert batsclass.rBody == 2.5
+    points = np.array([[10., -5., 3.], [40., 0., 0.], [0.5, 0.5, 0.5], [np.nan, 0., 0.]])
+
+    values, mask, status = batsclass.interpolate_many_vars_masked(points, ('rho', 'bx'))
+    assert list(status) == [PointOk_, PointOutside_, PointInBody_, PointOutside_]
+    assert list(mask) == [True, False, False, False]
+    assert np.array_equal(values[0], batsclass.interpolate_many_vars(points[:1], ('rho', 'bx'))[0])
+    assert np.all(np.isnan(values[1:]))
+
+    # Only points outside of the domain are filled in the other batch paths
+    rho = batsclass.interpolate_many(points, 'rho', -1.)
+    assert rho[1] == rho[3] == -1.
+    assert rho[2] == batsclass.interpolate(points[2], 'rho')
+
+    # The masked variants of the other batch paths
+    rho, rho_mask, rho_status = batsclass.interpolate_many_masked(points, 'rho')
+    assert np.array_equal(rho, values[:, 0], equal_nan=True)
+    assert np.array_equal(rho_mask, mask) and np.array_equal(rho_status, status)
+
+    grad_values, gradients, grad_mask, grad_status = batsclass.interpolate_many_vars_with_gradient_masked(points, ('rho', 'bx'))
+    assert np.allclose(grad_values, values, equal_nan=True)
+    assert np.allclose(gradients[0, 1], [0., 1., 0.])
+    assert np.all(np.isnan(gradients[1:]))
+    assert np.array_equal(grad_mask, mask) and np.array_equal(grad_status, status)
+
+    rho, grad_rho, grad_mask, grad_status = batsclass.interpolate_many_with_gradient_masked(points, 'rho')
+    assert np.array_equal(rho, grad_values[:, 0], equal_nan=True)
+    assert np.array_equal(grad_rho, gradients[:, 0], equal_nan=True)
+    assert np.array_equal(grad_status, status)
+
+    plan = batsclass.plan(points, False, True)
+    assert np.array_equal(plan.status, status)
+    assert np.allclose(plan.apply_vars(batsclass, ('rho', 'bx')), values, equal_nan=True)
+    assert batsclass.plan(points).status[2] == PointOk_
+
+
+def test_plan(native_file, tmp_path):
+    from conftest import write_native
+
+    batsclass = swmfio.read_batsrus(native_file)
+    points = np.vstack([_random_points(1000), [[40., 0., 0.]]])
+
+    plan = batsclass.plan(points)
+    expected = batsclass.interpolate_many_vars(points, ('rho', 'bx'))
+    assert np.allclose(plan.apply_vars(batsclass, ('rho', 'bx')), expected, equal_nan=True)
+    assert np.allclose(plan.apply(batsclass, 'rho'), expected[:, 0], equal_nan=True)
+    assert np.isnan(plan.apply(batsclass, 'rho')[-1])
+
+    # Another snapshot with the same grid
+    other = swmfio.read_batsrus(write_native(str(tmp_path / '3d__var_test')))
+    other.data_arr[:, other.varidx['rho']] *= 2
+    assert np.allclose(plan.apply(other, 'rho')[:-1], 2*expected[:-1, 0])
+
+    # With a halo, the plan gathers from the halo
+    halo = swmfio.read_batsrus(native_file, halo=True)
+    inner = np.random.default_rng(3).uniform(-24., 24., (500, 3))
+    assert np.allclose(halo.plan(inner).apply(halo, 'bx'), inner[:, 1])
+    with pytest.raises(RuntimeError):
+        halo.plan(inner).apply(batsclass, 'bx')
+
+    # Same cells, blocks in another order
+    reordered = swmfio.read_batsrus(native_file, reorder_blocks=True)
+    assert not np.array_equal(reordered.block2node, batsclass.block2node)
+    with pytest.raises(RuntimeError):
+        plan.apply(reordered, 'bx')
+    assert np.allclose(reordered.plan(points).apply(reordered, 'rho'), expected[:, 0], equal_nan=True)
+
+
+def test_sorted_batch(batsclass):
+    points = np.vstack([_random_points(3000), [[40., 0., 0.]]])
+    expected = batsclass.interpolate_many_vars(points, ('rho', 'bx'))
+    assert np.array_equal(batsclass.interpolate_many_vars(points, ('rho', 'bx'), np.nan, True), expected, equal_nan=True)
+
+    values, gradients = batsclass.interpolate_many_with_gradient(points, 'rho')
+    sorted_values, sorted_gradients = batsclass.interpolate_many_with_gradient(points, 'rho', np.nan, True)
+    assert np.array_equal(sorted_values, values, equal_nan=True)
+    assert np.array_equal(sorted_gradients, gradients, equal_nan=True)
+
+
+def test_reorder_blocks(native_file, batsclass):
+    from swmfio.batsrus_class import build_halo
+
+    reordered = swmfio.read_batsrus(native_file, reorder_blocks=True)
+
+    order = reordered.block_file_order
+    assert sorted(order) == list(range(batsclass.block2node.size))
+    assert not np.array_equal(order, np.arange(order.size))
+    assert np.array_equal(reordered.DataArray, batsclass.DataArray[..., order])
+    assert np.array_equal(reordered.block2node, batsclass.block2node[order])
+    assert np.all(reordered.node2block[reordered.block2node] == np.arange(order.size))
+
+    # Blocks follow the Morton index
+    assert np.array_equal(reordered.block2node + 1, reordered.morton_nodes)
+
+    points = _random_points(1000)
+    assert np.array_equal(reordered.interpolate_many(points, 'bx'), batsclass.interpolate_many(points, 'bx'))
+
+    build_halo(reordered)
+    inner = np.random.default_rng(3).uniform(-24., 24., (500, 3))
+    assert np.allclose(reordered.interpolate_many(inner, 'bx'), inner[:, 1])
+
+
+def test_cell_index(batsclass):
+    centers = batsclass.data_arr[:, 0:3].astype(np.float64)
+    cells, indx = batsclass.cell_index(centers)
+    assert np.array_equal(indx, np.arange(centers.shape[0]))
+
+    nI = batsclass.nI
+    i, j, k, iBlockP = np.unravel_index(indx, (nI, nI, nI, batsclass.block2node.size), order='F')
+    assert np.array_equal(cells, np.column_stack([iBlockP, i, j, k]))
+
+    variables = ('rho', 'bx', 'uz')
+    values = batsclass.cell_values(centers, variables)
+    assert np.array_equal(values, batsclass.interpolate_many_vars(centers, variables))
+    assert np.array_equal(values[:, 0], batsclass.data_arr[:, batsclass.varidx['rho']])
+
+    assert np.array_equal(batsclass.get_native_partial_derivatives(indx[100], 'bx'),
+                          batsclass.get_native_partial_derivatives(100, 'bx'))
+
+    cells, indx = batsclass.cell_index(np.array([[40., 0., 0.]]))
+    assert indx[0] == -1 and np.all(cells == -1)
+    assert np.isnan(batsclass.get_native_values(indx, ('rho',))[0, 0])
+
+
+def test_remap_conservative(batsclass):
+    from swmfio.batsrus_class import remap_conservative
+    from conftest import fields
+
+    rho = batsclass.data_arr[:, batsclass.varidx['rho']].astype(np.float64)
+    measure = batsclass.data_arr[:, batsclass.varidx['measure']].astype(np.float64)
+    total = np.sum(rho*measure)
+
+    # Coarser than native: octants are averages of the linear field, which
+    # are its values at the octant centers
+    values, volume = remap_conservative(batsclass, ('rho', 'bx'), (2, 2, 2))
+    assert np.allclose(volume, 32.**3)
+    c = np.array([-16., 16.])
+    X, Y, Z = np.meshgrid(c, c, c, indexing='ij')
+    assert np.allclose(values[0], fields(X, Y, Z)['rho'])
+    assert np.allclose(values[1], Y)
+
+    # Finer than native: each grid cell is inside one native cell
+    values, volume = remap_conservative(batsclass, ('rho',), (32, 32, 32))
+    c = -31. + 2*np.arange(32)
+    X, Y, Z = np.meshgrid(c, c, c, indexing='ij')
+    centers = np.column_stack([X.ravel(), Y.ravel(), Z.ravel()])
+    assert np.allclose(values[0].ravel(), batsclass.cell_values(centers, ('rho',))[:, 0])
+    assert np.isclose(np.sum(values[0]*volume), total)
+
+    # Unaligned grid that extends past the domain
+    bounds = ((-40., 37.), (-35., 33.), (-50., 41.))
+    values, volume = remap_conservative(batsclass, ('rho',), (5, 7, 3), bounds)
+    assert np.isclose(np.sum(volume), 64.**3)
+    assert np.isclose(np.nansum(values[0]*volume), total)
+
+
+def test_grid_derivatives(batsclass):
+    shape = batsclass.DataArray[batsclass.varidx['rho']].shape
+
+    ddx, ddy, ddz = batsclass.gradient('rho')
+    assert ddx.shape == shape
+    assert np.allclose(ddx, 0.1, atol=1e-5)
+    assert np.allclose(ddy, -0.05, atol=1e-5)
+    assert np.allclose(ddz, 0.02, atol=1e-5)
+
+    # Flattened in Fortran order, cells are in the order of data_arr rows
+    for indx in (0, 100, 63, 500):
+        assert np.array_equal([d.ravel(order='F')[indx] for d in batsclass.gradient('bx')],
+                              batsclass.get_native_partial_derivatives(indx, 'bx'))
+
+    # B = (y, -x, 1)
+    cx, cy, cz = batsclass.curl('bx', 'by', 'bz')
+    assert np.allclose(cx, 0., atol=1e-5) and np.allclose(cy, 0., atol=1e-5)
+    assert np.allclose(cz, -2., atol=1e-5)
+
+    assert np.allclose(batsclass.divergence('bx', 'by', 'bz'), 0., atol=1e-5)
+    assert np.allclose(batsclass.divergence('ux', 'uy', 'uz'), 0., atol=1e-5)
+    assert np.allclose(batsclass.divergence('rho', 'rho', 'rho'), 0.07, atol=1e-5)
+
+
+def test_grid_derivatives_across_blocks(native_file):
+    from swmfio.batsrus_class import build_halo
+
+    batsclass = swmfio.read_batsrus(native_file)
+    with pytest.raises(RuntimeError):
+        batsclass.gradient('rho', True)
+
+    # q = x**2, for which centered differences are exact
+    x = batsclass.data_arr[:, batsclass.varidx['x']]
+    batsclass.data_arr[:, batsclass.varidx['rho']] = x**2
+    build_halo(batsclass)
+
+    inside, _, _ = batsclass.gradient('rho')
+    across, _, _ = batsclass.gradient('rho', True)
+    exact = 2*batsclass.DataArray[batsclass.varidx['x']]
+
+    # Same inside blocks; better at block faces
+    nI = batsclass.nI
+    assert np.array_equal(across[1:nI-1], inside[1:nI-1])
+    err_inside = np.abs(inside - exact)
+    err_across = np.abs(across - exact)
+    assert np.all(err_across <= err_inside + 1e-4)
+    # (both are one-sided at the domain boundary)
+    assert err_across.sum() < 0.5*err_inside.sum()
+
+    # Exact at faces between blocks of the same level, e.g., x = 0 between
+    # the level-1 blocks at y, z > 0
+    face = (np.abs(batsclass.DataArray[batsclass.varidx['x']]) < 5) & \
+           (batsclass.DataArray[batsclass.varidx['y']] > 0) & \
+           (batsclass.DataArray[batsclass.varidx['z']] > 0)
+    assert np.allclose(across[face], exact[face], atol=1e-3)
+    assert not np.allclose(inside[face], exact[face], atol=1e-3)
+
+    # Linear fields are exact, also across level changes, except next to the
+    # domain boundary, where the halo copies the nearest cell
+    away = np.all([np.abs(batsclass.DataArray[batsclass.varidx[c]]) < 24 for c in 'xyz'], axis=0)
+    for d, expected in zip(batsclass.gradient('bx', True), (0., 1., 0.)):
+        assert np.allclose(d[away], expected, atol=1e-5)
+    cx, cy, cz = batsclass.curl('bx', 'by', 'bz', True)
+    assert np.allclose(cz[away], -2., atol=1e-5)
+    assert np.allclose(batsclass.divergence('ux', 'uy', 'uz', True)[away], 0., atol=1e-5)
+
+    for indx in (0, 3, 100, 500):
+        assert across.ravel(order='F')[indx] == batsclass.get_native_partial_derivatives(indx, 'rho', True)[0]
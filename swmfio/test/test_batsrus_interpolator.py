@@ -0,0 +1,178 @@
+import importlib
+import numpy as np
+import pytest
+
+import swmfio
+from conftest import write_native, fields
+
+
+def test_numba_engine(tmp_path):
+
+    batsclass = swmfio.read_batsrus(write_native(str(tmp_path / '3d__var_1')))
+    binterp = swmfio.batsrus_interpolator(batsclass, engine='numba')
+    binterp.register_variable('rho')
+    binterp.register_variable('bx')
+
+    # Linear fields are exact where the stencil has one resolution: inside
+    # the coarse block [0, 32]^3 and across the fine blocks of [-32, 0]^3
+    rng = np.random.default_rng(3)
+    points = np.concatenate((rng.uniform(4., 28., (100, 3)), rng.uniform(-30., -2., (100, 3))))
+    expected = fields(*points.T)
+
+    rho = binterp.interp(points, 'rho')
+    assert rho.shape == (200,)
+    assert np.allclose(rho, expected['rho'], rtol=1e-5)
+
+    both = binterp.interp(points, ['rho', 'bx'])
+    assert both.shape == (200, 2)
+    assert np.array_equal(both[:, 0], rho)
+    assert np.allclose(both[:, 1], expected['bx'], atol=1e-4)
+
+    # One point, as in demo_interpolator.py
+    assert np.isclose(binterp.interp(list(points[0]), 'rho')[0], rho[0])
+
+    assert np.isnan(binterp.interp([40., 0., 0.], 'rho')[0])
+
+    with pytest.raises(KeyError):
+        binterp.interp(points, 'by')
+
+
+def test_numba_engine_matches_octree(tmp_path):
+
+    pytest.importorskip("swmfio.OCTREE_BLOCK_GRID._interpolate_amrdata")
+
+    batsclass = swmfio.read_batsrus(write_native(str(tmp_path / '3d__var_1')))
+    octree = swmfio.batsrus_interpolator(batsclass)
+    native = swmfio.batsrus_interpolator(batsclass, engine='numba')
+
+    # Also across the changes of resolution around [-32, 0]^3. Within half
+    # a cell of the outer boundary, the library reads stencil values it did
+    # not set, which depend on the points interpolated before.
+    points = np.random.default_rng(4).uniform(-28., 28., (2000, 3))
+    for var in ('rho', 'ux', 'bx', 'by'):
+        octree.register_variable(var)
+        native.register_variable(var)
+        assert np.allclose(native.interp(points, var), octree.interp(points, var), rtol=1e-5, atol=1e-5)
+
+
+def test_nthreads(tmp_path):
+
+    batsclass = swmfio.read_batsrus(write_native(str(tmp_path / '3d__var_1')))
+    binterp = swmfio.batsrus_interpolator(batsclass, engine='numba')
+    binterp.register_variable('rho')
+
+    points = np.random.default_rng(6).uniform(-24., 24., (1000, 3))
+    assert np.array_equal(binterp.interp(points, 'rho', nthreads=1), binterp.interp(points, 'rho'))
+
+    # swmfio.batsrus_interpolator is the class; check its module
+    if importlib.import_module('swmfio.batsrus_interpolator').lib is not None:
+        binterp = swmfio.batsrus_interpolator(batsclass)
+        binterp.register_variable('rho')
+        try:
+            # Worker processes set up their own octree
+            rho = binterp.interp(points, 'rho')
+            assert np.array_equal(binterp.interp(points, 'rho', nthreads=2), rho)
+            # bx is registered in the running workers on first use
+            binterp.register_variable('bx')
+            expected = binterp.interp(points, ['rho', 'bx'])
+            assert np.array_equal(binterp.interp(points, ['rho', 'bx'], nthreads=2), expected)
+        finally:
+            binterp.close()
+
+
+def test_octree_multiple_variables_and_cache(tmp_path):
+
+    pytest.importorskip("swmfio.OCTREE_BLOCK_GRID._interpolate_amrdata")
+    module = importlib.import_module('swmfio.batsrus_interpolator')
+    module.clear_octree_cache()
+
+    file = write_native(str(tmp_path / '3d__var_1'))
+    a = swmfio.batsrus_interpolator(swmfio.read_batsrus(file))
+    for var in ('rho', 'bx', 'by'):
+        a.register_variable(var)
+
+    points = np.random.default_rng(7).uniform(-24., 24., (300, 3))
+    values = a.interp(points, ['rho', 'bx', 'by'])
+    assert values.shape == (300, 3)
+    for v, var in enumerate(('rho', 'bx', 'by')):
+        assert np.array_equal(values[:, v], a.interp(points, var))
+    # (the library is not exact at changes of resolution)
+    assert np.median(np.abs(values[:, 1] - points[:, 1])) < 1e-4
+
+    # Same grid: the octree is reused
+    b = swmfio.batsrus_interpolator(swmfio.read_batsrus(file))
+    b.register_variable('rho')
+    assert b.octree is a.octree
+
+    # Another grid (blocks in another order) and back: the library is set
+    # up again for each
+    c = swmfio.batsrus_interpolator(swmfio.read_batsrus(file, reorder_blocks=True))
+    c.register_variable('rho')
+    assert c.octree is not a.octree
+    assert np.array_equal(c.interp(points, 'rho'), values[:, 0])
+    assert np.array_equal(a.interp(points, 'rho'), values[:, 0])
+
+    module.clear_octree_cache()
+    d = swmfio.batsrus_interpolator(swmfio.read_batsrus(file))
+    d.register_variable('rho')
+    assert d.octree is not a.octree
+    assert np.array_equal(d.interp(points, 'rho'), values[:, 0])
+
+
+def test_octree_failures_are_logged(tmp_path, caplog):
+
+    pytest.importorskip("swmfio.OCTREE_BLOCK_GRID._interpolate_amrdata")
+
+    binterp = swmfio.batsrus_interpolator(swmfio.read_batsrus(write_native(str(tmp_path / '3d__var_1'))))
+    binterp.register_variable('rho')
+
+    # Points outside of the grid are NaN, without a warning
+    with caplog.at_level('WARNING', logger=swmfio.logger.name):
+        assert np.isnan(binterp.interp([40., 0., 0.], 'rho')[0])
+    assert not caplog.records
+
+    # NaN at points inside the grid is reported
+    binterp.var_data['rho'][:] = np.nan
+    with caplog.at_level('WARNING', logger=swmfio.logger.name):
+        binterp.interp([[1., 2., 3.], [40., 0., 0.]], 'rho')
+    assert 'failed at 1 of 2 points' in caplog.text
+
+
+_concurrent_script = """
+import sys, threading
+import numpy as np
+import swmfio
+sys.path.insert(0, sys.argv[2])
+from conftest import write_native
+
+binterp = swmfio.batsrus_interpolator(swmfio.read_batsrus(write_native(sys.argv[1])), engine='numba')
+binterp.register_variable('rho')
+points = np.random.default_rng(8).uniform(-32., 32., (20000, 3))
+expected = binterp.interp(points, 'rho')
+
+results = [None]*4
+def run(i):
+    for n in range(5):
+        results[i] = binterp.interp(points, 'rho')
+threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+assert all(np.array_equal(r, expected, equal_nan=True) for r in results)
+"""
+
+def test_numba_engine_concurrent(tmp_path):
+
+    import os
+    import subprocess
+    import sys
+
+    # The workqueue threading layer aborts the process when two threads run
+    # a parallel kernel at once
+    env = dict(os.environ, NUMBA_THREADING_LAYER='workqueue', NUMBA_NUM_THREADS='2')
+    root = os.path.dirname(os.path.dirname(swmfio.__file__))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (root, env.get('PYTHONPATH'))))
+    result = subprocess.run([sys.executable, '-c', _concurrent_script, str(tmp_path / '3d__var_1'),
+                             os.path.dirname(__file__)], env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
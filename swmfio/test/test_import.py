@@ -0,0 +1,21 @@
+import sys
+import subprocess
+
+HEAVY = ('numpy', 'numba', 'scipy', 'cffi')
+
+def _loaded_after(code):
+    code = code + "\nimport sys\nprint(' '.join(m for m in {} if m in sys.modules))".format(HEAVY)
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return out.stdout.split()
+
+def test_import_is_lazy():
+    assert _loaded_after("import swmfio") == []
+    assert _loaded_after("import swmfio; swmfio.dlfile; swmfio.fileparts") == []
+
+def test_lazy_attributes():
+    import swmfio
+    import swmfio.read_batsrus
+    # Importing the submodule must not shadow the function of the same name.
+    assert callable(swmfio.read_batsrus)
+    assert swmfio.fileparts('/a/b.out') == ('/a', 'b', '.out')
+    assert 'dlfile' in dir(swmfio)
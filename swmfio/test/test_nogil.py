@@ -0,0 +1,36 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from swmfio import batsrus_nogil
+
+
+def test_concurrent_queries(batsclass):
+    points = np.random.default_rng(4).uniform(-32., 32., (4000, 3))
+    points[0] = [40., 0., 0.]
+
+    expected = batsclass.interpolate_many_vars(points, ('rho', 'bx'))
+    partials = [batsclass.get_native_partial_derivatives(indx, 'bx') for indx in range(0, 960, 7)]
+
+    def work(chunk):
+        values = batsrus_nogil.interpolate_many_vars(batsclass, chunk, ('rho', 'bx'))
+        rho = batsrus_nogil.interpolate_many(batsclass, chunk, 'rho')
+        derivatives = [batsrus_nogil.get_native_partial_derivatives(batsclass, indx, 'bx')
+                            for indx in range(0, 960, 7)]
+        return values, rho, derivatives
+
+    # Many small chunks so that threads overlap
+    chunks = np.array_split(points, 40)
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(work, chunks))
+
+    values = np.concatenate([result[0] for result in results])
+    rho = np.concatenate([result[1] for result in results])
+    assert np.array_equal(values, expected, equal_nan=True)
+    assert np.array_equal(rho, expected[:, 0], equal_nan=True)
+    for result in results:
+        for a, b in zip(result[2], partials):
+            assert np.array_equal(a, b)
+
+    point = points[1]
+    assert batsrus_nogil.find_tree_node(batsclass, point) == batsclass.find_tree_node(point)
+    assert batsrus_nogil.interpolate(batsclass, point, 'rho') == batsclass.interpolate(point, 'rho')
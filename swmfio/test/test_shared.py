@@ -0,0 +1,41 @@
+import pickle
+import multiprocessing
+import numpy as np
+
+import swmfio
+
+points = np.array([[-20., -20., -20.], [10., -5., 3.], [1., 2., 3.], [-3., 25., -9.]])
+
+def _work(handle):
+    batsclass = handle.attach()
+    rho = [batsclass.interpolate(point, 'rho') for point in points]
+    return rho, batsclass.get_native_partial_derivatives(100, 'bx')
+
+def test_shared_roundtrip(native_file):
+
+    batsclass = swmfio.read_batsrus(native_file, lookup_grid=True, morton_index=True)
+
+    handle = swmfio.export_shared(batsclass)
+    try:
+        handle = pickle.loads(pickle.dumps(handle))
+
+        expected = ([batsclass.interpolate(point, 'rho') for point in points],
+                    batsclass.get_native_partial_derivatives(100, 'bx'))
+
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(2) as pool:
+            results = pool.map(_work, [handle, handle])
+
+        for rho, partials in results:
+            assert np.all(rho == np.array(expected[0]))
+            assert np.all(partials == expected[1])
+
+        attached = swmfio.attach_shared(handle)
+        assert np.all(attached.block2node == batsclass.block2node)
+        assert np.all(attached.DataArray == batsclass.DataArray)
+        assert not np.shares_memory(attached.data_arr, batsclass.data_arr)
+        assert np.all(attached.lookup_grid == batsclass.lookup_grid)
+        assert attached.lookup_dx == batsclass.lookup_dx
+        assert np.all(attached.morton_keys == batsclass.morton_keys)
+    finally:
+        handle.unlink()
@@ -0,0 +1,40 @@
+import numpy as np
+
+import swmfio
+from conftest import write_native, fields
+
+
+def test_space_time_interpolation(tmp_path):
+
+    # Outputs 0 and 1 have the same grid; output 2 has its blocks in another
+    # order. rho is scaled by 1, 2 and 4 in them.
+    files = [write_native(str(tmp_path / f'3d__var_{n}'), seed=seed) for n, seed in enumerate((0, 0, 1))]
+
+    loaded = []
+    def loader(file):
+        batsclass = swmfio.read_batsrus(file, halo=True)
+        batsclass.halo_arr[:, batsclass.varidx['rho']] *= 2**int(file[-1])
+        loaded.append(file)
+        return batsclass
+
+    sti = swmfio.SpaceTimeInterpolator(files, [0., 10., 20.], loader=loader)
+
+    rng = np.random.default_rng(5)
+    t = np.sort(rng.uniform(-5., 25., 300))
+    points = rng.uniform(-24., 24., (300, 3))
+    values = sti.interpolate(t, points, ('rho', 'bx'))
+
+    # Each file is read once; at most two are kept
+    assert loaded == files
+    assert len(sti.window) == 2
+    assert sti.plan_reuses == 1
+
+    rho = fields(*points.T)['rho']
+    scale = np.interp(t, [0., 10., 20.], [1., 2., 4.])
+    valid = (t >= 0) & (t <= 20)
+    assert np.allclose(values[valid, 0], scale[valid]*rho[valid], rtol=1e-4)
+    assert np.allclose(values[valid, 1], points[valid, 1], atol=1e-4)
+    assert np.all(np.isnan(values[~valid]))
+
+    # At the time of an output
+    assert np.allclose(sti.interpolate([20.], points[:1], ('rho',))[0, 0], 4*rho[0], rtol=1e-4)
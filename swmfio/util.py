@@ -1,6 +1,5 @@
-import numpy as np
-from numba import njit
 import re
+import contextlib
 
 def _dlfile(url, dir=None, progress=False):
 
@@ -108,8 +107,65 @@ def grep_dash_o(RE, lines):
             ret = ret + '\n'.join(findall) + '\n'
     return ret
 
-@njit
-def unravel_index(index, shape, order='C'):
+class ReadStats():
+    """Wall time, bytes read, read rate and peak allocated memory for each
+    phase of a file read. Pass an instance as the stats argument of
+    read_batsrus() and it is filled in place, e.g.,
+
+        stats = swmfio.ReadStats()
+        batsclass = swmfio.read_batsrus(file, stats=stats)
+        print(stats)
+
+    Peak memory is measured with tracemalloc, which sees NumPy allocations
+    but not arrays allocated inside numba-compiled code. Tracing slows
+    allocation-heavy phases slightly; use trace_memory=False to disable it.
+    """
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        # Phase name => dict with keys 'time' [s], 'bytes', 'MB/s', 'peak' [bytes]
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name, nbytes=0):
+
+        import time
+        import tracemalloc
+        import swmfio
+
+        started = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started = True
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            peak = 0
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                if started:
+                    tracemalloc.stop()
+            rate = nbytes/wall/1e6 if nbytes > 0 and wall > 0 else 0.
+            self.phases[name] = {'time': wall, 'bytes': nbytes, 'MB/s': rate, 'peak': peak}
+            swmfio.logger.info(f"{name}: {wall:.3f} s, {nbytes/1e6:.1f} MB read, {rate:.1f} MB/s, {peak/1e6:.1f} MB peak")
+
+    @property
+    def time(self):
+        return sum(phase['time'] for phase in self.phases.values())
+
+    def __str__(self):
+        lines = [f"{'phase':<24} {'time [s]':>9} {'read [MB]':>10} {'MB/s':>9} {'peak [MB]':>10}"]
+        for name, phase in self.phases.items():
+            lines.append(f"{name:<24} {phase['time']:9.3f} {phase['bytes']/1e6:10.1f} {phase['MB/s']:9.1f} {phase['peak']/1e6:10.1f}")
+        lines.append(f"{'total':<24} {self.time:9.3f}")
+        return "\n".join(lines)
+
+def _unravel_index(index, shape, order='C'):
     if order=='F':
         pass
     else:
@@ -128,3 +184,14 @@ def unravel_index(index, shape, order='C'):
         return multiindex
     else:
         return multiindex[::-1]
+
+def __getattr__(name):
+    # unravel_index is compiled with numba on first access so that importing
+    # this module (e.g., for dlfile) does not import numba.
+    if name == 'unravel_index':
+        from numba import njit
+        global np, unravel_index
+        import numpy as np
+        unravel_index = njit(_unravel_index)
+        return unravel_index
+    raise AttributeError(f"module 'swmfio.util' has no attribute '{name}'")
@@ -61,10 +61,17 @@ def write_vtk(file_or_class, variables="all", epsilon=None, blocks=None, use_asc
     if epsilon is not None:
         is_selected = epsilon == x_blk[1,0,0, :] - x_blk[0,0,0, :]
 
+    # Block numbers in the output and in blocks are in file order
+    if batsclass.block_file_order.size > 0:
+        file_order = batsclass.block_file_order
+    else:
+        file_order = np.arange(nBlock)
+
     if blocks is not None:
         blocks = np.array(blocks)
         is_selected[:] = False
-        is_selected[blocks] = True
+        is_selected[np.argsort(file_order)[blocks]] = True
+        last_block = np.max(np.nonzero(is_selected)[0])
 
     cell_data = []
     for vv in ['b','j','u','b1']:
@@ -99,15 +106,15 @@ def write_vtk(file_or_class, variables="all", epsilon=None, blocks=None, use_asc
 
         swmfio.logger.debug(f"  Creating grid for block #{iBlockP+1}/{nBlock+1}")
 
-        if blocks is not None and iBlockP > blocks[-1]:
-            swmfio.logger.debug("  iBlockP > blocks[-1]. Done.")
+        if blocks is not None and iBlockP > last_block:
+            swmfio.logger.debug("  iBlockP > last selected block. Done.")
             break
 
         if not is_selected[iBlockP]:
             swmfio.logger.debug(f"  Block #{iBlockP+1} not selected. Omitting.")
             continue
 
-        block_id[cellIndexStart:cellIndexStart+nI*nJ*nK] = iBlockP
+        block_id[cellIndexStart:cellIndexStart+nI*nJ*nK] = file_order[iBlockP]
         cellIndexStart = cellIndexStart + nI*nJ*nK
 
         gridspacing = x_blk[1,0,0, iBlockP] - x_blk[0,0,0, iBlockP]
@@ -152,8 +159,8 @@ def write_vtk(file_or_class, variables="all", epsilon=None, blocks=None, use_asc
 
         swmfio.logger.debug(f"  Creating cells for block #{iBlockP+1}/{nBlock+1}")
 
-        if blocks is not None and iBlockP > blocks[-1]:
-            swmfio.logger.debug("  iBlockP > blocks[-1]. Done.")
+        if blocks is not None and iBlockP > last_block:
+            swmfio.logger.debug("  iBlockP > last selected block. Done.")
             break
 
         if not is_selected[iBlockP]: